@@ -0,0 +1,113 @@
+"""
+Generators of synthetic programs for compiler benchmarks.
+Every generator is deterministic, so the same program is generated on every run
+"""
+
+import random
+
+
+def unrolled_for(iterations: int = 2000) -> str:
+    """
+    Large unrolled FOR loop
+    :param iterations: amount of loop iterations
+    :return: code string
+    """
+
+    return "\n".join([
+        "_start:",
+        f"    FOR i IN 0..{iterations} {{",
+        "        LRA i",
+        "        ADD $1",
+        "        SRA $1",
+        "        LRA $2",
+        "        ADC 0",
+        "        SRA $2",
+        "        LRA i",
+        "        XOR $3",
+        "        SRA $3",
+        "        CCF",
+        "    }",
+        "_end:",
+        "    HALT",
+        ""
+    ])
+
+
+def nested_macros(depth: int = 8, calls: int = 40) -> str:
+    """
+    Deeply nested macros, each macro calls the previous one twice
+    :param depth: amount of nested macros
+    :param calls: amount of calls of the outermost macro
+    :return: code string
+    """
+
+    lines = [
+        "macro m0(adr, val) {",
+        "    LRA val",
+        "    ADD adr",
+        "    SRA adr",
+        "}",
+        ""
+    ]
+    for level in range(1, depth):
+        lines += [
+            f"macro m{level}(adr, val) {{",
+            f"    m{level - 1}(adr, val)",
+            f"    m{level - 1}(adr, {level})",
+            "}",
+            ""
+        ]
+
+    lines.append("_start:")
+    for call in range(calls):
+        lines.append(f"    m{depth - 1}(${call % 256}, {call % 256})")
+    lines += ["_end:", "    HALT", ""]
+    return "\n".join(lines)
+
+
+def labels_and_jumps(labels: int = 3000, seed: int = 0) -> str:
+    """
+    Thousands of labels, with jumps between them across ROM pages
+    :param labels: amount of labels
+    :param seed: random seed
+    :return: code string
+    """
+
+    rng = random.Random(seed)
+    jumps = ["JMP", "JMPZ", "JMPN", "JMPC", "JMPP", "CALL"]
+    lines = ["_start:"]
+    for label in range(labels):
+        lines.append(f"label_{label}:")
+        for _ in range(rng.randint(1, 5)):
+            lines.append(f"    ADD {rng.randint(0, 255)}")
+        lines.append(f"    {rng.choice(jumps)} $label_{rng.randrange(labels)}")
+    lines += ["_end:", "    HALT", ""]
+    return "\n".join(lines)
+
+
+def long_strings(strings: int = 100, length: int = 240, seed: int = 0) -> str:
+    """
+    Long strings written with __WRITE_STR__
+    :param strings: amount of strings
+    :param length: length of each string
+    :param seed: random seed
+    :return: code string
+    """
+
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .!?"
+    lines = ["_start:"]
+    for string in range(strings):
+        text = "".join(rng.choice(alphabet) for _ in range(length))
+        lines.append(f"    __WRITE_STR__ {string * length} \"{text}\"")
+    lines += ["_end:", "    HALT", ""]
+    return "\n".join(lines)
+
+
+# benchmark name -> generator
+GENERATORS = {
+    "unrolled_for": unrolled_for,
+    "nested_macros": nested_macros,
+    "labels_and_jumps": labels_and_jumps,
+    "long_strings": long_strings
+}
@@ -0,0 +1,78 @@
+"""
+Memory benchmark for the compiler.
+Compiles the shipped examples scaled up, and reports how much memory the tokens take
+and the peak memory of the whole compilation
+"""
+
+import io
+import re
+import sys
+import argparse
+import tracemalloc
+from pathlib import Path
+from contextlib import redirect_stdout
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from mqa import Tokenizer, Compiler
+
+
+EXAMPLES = Path(__file__).parent.parent / "examples"
+
+
+def scale(code: str, times: int) -> str:
+    """
+    Repeats the code, giving each copy its own labels and macros
+    :param code: code string
+    :param times: amount of copies
+    :return: scaled code string
+    """
+
+    names = set(re.findall(r"^\s*([A-Za-z_]\w*):", code, re.MULTILINE))
+    names |= set(re.findall(r"^\s*macro\s+([A-Za-z_]\w*)", code, re.MULTILINE))
+    if not names:
+        return "\n".join([code] * times)
+
+    pattern = re.compile(r"\b(" + "|".join(names) + r")\b")
+    return "\n".join(pattern.sub(lambda match: f"{match[1]}_{idx}", code) for idx in range(times))
+
+
+def measure(code: str) -> dict[str, int]:
+    """
+    Measures memory used by each compilation stage
+    :param code: code string
+    :return: measurements in bytes
+    """
+
+    tracemalloc.start()
+
+    token_list = Tokenizer.tokenize(code)
+    tokens_size = tracemalloc.get_traced_memory()[0]
+
+    token_tree = Tokenizer.build_token_tree(token_list)
+    del token_list
+
+    compiler = Compiler(None)
+    with redirect_stdout(io.StringIO()):
+        compiler.compile(token_tree)
+
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"instructions": len(compiler.main), "tokens": tokens_size, "peak": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures compiler memory usage on scaled up examples.")
+    parser.add_argument("-s", "--scale", type=int, default=200, help="how many times each example is repeated")
+    args = parser.parse_args()
+
+    print(f"{'example':<12} | {'instructions':>12} | {'tokens MiB':>10} | {'peak MiB':>10}")
+    for path in sorted(EXAMPLES.glob("*.mqas")):
+        result = measure(scale(path.read_text(encoding="utf8"), args.scale))
+        print(f"{path.stem:<12} | {result['instructions']:>12} | "
+              f"{result['tokens'] / 2**20:>10.2f} | {result['peak'] / 2**20:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
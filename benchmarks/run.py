@@ -0,0 +1,167 @@
+"""
+Compiler benchmark runner.
+Compiles synthetic programs, and records throughput, peak memory, output size and output hash of each.
+Compares the results with the baseline, and fails if any of them got worse than the threshold allows,
+or if the output bytes have changed
+"""
+
+import gc
+import io
+import sys
+import json
+import time
+import hashlib
+import statistics
+import argparse
+import tracemalloc
+from pathlib import Path
+from contextlib import redirect_stdout
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from mqa import Tokenizer, Compiler, Constructor
+from generators import GENERATORS
+
+
+BASELINE = Path(__file__).parent / "baseline.json"
+
+
+def compile_code(code: str) -> tuple[bytes, int]:
+    """
+    Compiles the code into the executable
+    :param code: code string
+    :return: executable bytes, and amount of emitted instructions
+    """
+
+    token_tree = Tokenizer.build_token_tree(Tokenizer.tokenize(code))
+    compiler = Compiler(None)
+    with redirect_stdout(io.StringIO()):
+        compiler.compile(token_tree)
+    return bytes(Constructor.generate_bytes(compiler.includes, compiler.main)), len(compiler.main)
+
+
+def reference_work() -> None:
+    """
+    Fixed amount of work, which is timed next to the compilation, to know how fast the machine is at the moment
+    """
+
+    table = {}
+    for idx in range(60000):
+        table[f"label_{idx & 1023}"] = idx * 3 & 255
+    sorted(table.items(), key=lambda item: item[1])
+
+
+def run_benchmark(code: str, repeat: int, min_time: float) -> dict:
+    """
+    Runs one benchmark.
+    Throughput is measured in emitted instructions, as a few source lines may expand into a lot of code.
+    The compared throughput is relative to the reference work, which is timed between the runs,
+    so that the machine getting slower for a while doesn't look like a regression.
+    Median times are used, as the fastest runs are as noisy as the slowest ones
+    :param code: code string
+    :param repeat: least amount of timed runs
+    :param min_time: least total time of the timed runs in seconds
+    :return: results
+    """
+
+    times = []
+    reference_times = []
+    while len(times) < repeat or sum(times) < min_time:
+        start = time.perf_counter()
+        reference_work()
+        reference_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        output, instructions = compile_code(code)
+        times.append(time.perf_counter() - start)
+
+    median_time = statistics.median(times)
+    median_reference = statistics.median(reference_times)
+
+    # memory is measured separately, as tracing slows everything down
+    # (garbage of the timed runs is collected first, so the collections during the run are always the same)
+    gc.collect()
+    tracemalloc.start()
+    compile_code(code)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "lines": code.count("\n") + 1,
+        "instructions": instructions,
+        "instructions_per_sec": round(instructions / median_time),
+        "instructions_per_reference": round(instructions * median_reference / median_time, 1),
+        "peak_memory": peak_memory,
+        "size": len(output),
+        "sha256": hashlib.sha256(output).hexdigest()
+    }
+
+
+def compare(name: str, result: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compares the results with the baseline
+    :param name: benchmark name
+    :param result: benchmark results
+    :param baseline: baseline results
+    :param threshold: allowed relative regression
+    :return: list of regressions
+    """
+
+    regressions = []
+    if result["sha256"] != baseline["sha256"]:
+        regressions.append(f"{name}: output bytes have changed")
+    if result["size"] > baseline["size"]:
+        regressions.append(f"{name}: output size {baseline['size']} -> {result['size']} bytes")
+    if result["instructions_per_reference"] < baseline["instructions_per_reference"] * (1 - threshold):
+        regressions.append(
+            f"{name}: throughput {baseline['instructions_per_reference']} -> {result['instructions_per_reference']} "
+            f"instructions per reference work")
+    if result["peak_memory"] > baseline["peak_memory"] * (1 + threshold):
+        regressions.append(f"{name}: peak memory {baseline['peak_memory']} -> {result['peak_memory']} bytes")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs compiler benchmarks, and compares them with the baseline.")
+    parser.add_argument("benchmarks", nargs="*", choices=[[], *GENERATORS], help="benchmarks to run (default is all)")
+    parser.add_argument("-r", "--repeat", type=int, default=15,
+                        help="least amount of timed runs of each benchmark (default is 15)")
+    parser.add_argument("-m", "--min-time", type=float, default=2.0,
+                        help="least total time of the timed runs of each benchmark in seconds (default is 2)")
+    parser.add_argument("-t", "--threshold", type=float, default=0.25,
+                        help="allowed relative regression of throughput and memory (default is 0.25)")
+    parser.add_argument("-u", "--update", help="save the results as the new baseline", action="store_true")
+    args = parser.parse_args()
+
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<18} | {'lines':>7} | {'instructions':>12} | {'instr/sec':>10} | {'peak MiB':>8} | "
+          f"{'size':>7}")
+    for name in args.benchmarks or GENERATORS:
+        result = run_benchmark(GENERATORS[name](), args.repeat, args.min_time)
+        results[name] = result
+        print(f"{name:<18} | {result['lines']:>7} | {result['instructions']:>12} | "
+              f"{result['instructions_per_sec']:>10} | "
+              f"{result['peak_memory'] / 2**20:>8.2f} | {result['size']:>7}")
+
+        if name in baseline and not args.update:
+            regressions += compare(name, result, baseline[name], args.threshold)
+
+    if args.update:
+        baseline.update(results)
+        BASELINE.write_text(json.dumps(baseline, indent=4) + "\n")
+        print(f"Baseline saved to '{BASELINE}'")
+        return
+
+    if regressions:
+        print("Regressions:")
+        for regression in regressions:
+            print(f"\t{regression}")
+        exit(1)
+    print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
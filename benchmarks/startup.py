@@ -0,0 +1,70 @@
+"""
+Startup benchmark.
+Measures how long a new interpreter takes to import the package, to print the command line help,
+and to compile a small program, compared with an interpreter that does nothing.
+Fails if importing the package or printing the help takes longer than the limit
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+
+SRC = Path(__file__).parent.parent / "src"
+EXAMPLE = Path(__file__).parent.parent / "examples" / "fibonacci.mqas"
+
+# name, interpreter arguments, if the time is checked against the limit
+COMMANDS: list[tuple[str, list[str], bool]] = [
+    ("python", ["-c", "pass"], False),
+    ("import mqa", ["-c", "import mqa"], True),
+    ("mqa --help", ["-m", "mqa", "--help"], True),
+    ("compile_source", ["-c", f"import mqa; mqa.compile_source(open({str(EXAMPLE)!r}).read())"], False),
+]
+
+
+def measure(arguments: list[str], repeat: int) -> float:
+    """
+    Runs a new interpreter multiple times
+    :param arguments: interpreter arguments
+    :param repeat: amount of runs
+    :return: median wall time in seconds
+    """
+
+    env = dict(os.environ, PYTHONPATH=str(SRC))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *arguments], env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures startup time of the compiler.")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="amount of runs of each command")
+    parser.add_argument("-l", "--limit", type=float, default=50,
+                        help="allowed time on top of the interpreter startup in ms (default is 50)")
+    args = parser.parse_args()
+
+    results = {name: measure(arguments, args.repeat) for name, arguments, _ in COMMANDS}
+    interpreter = results["python"]
+
+    failed = []
+    print(f"{'command':<16} | {'median ms':>10} | {'over python ms':>14}")
+    for name, _, checked in COMMANDS:
+        over = (results[name] - interpreter) * 1000
+        print(f"{name:<16} | {results[name] * 1000:>10.1f} | {over:>14.1f}")
+        if checked and over > args.limit:
+            failed.append(name)
+
+    if failed:
+        print(f"FAIL: {', '.join(failed)} took more than {args.limit} ms over the interpreter startup")
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
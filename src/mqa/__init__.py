@@ -1,4 +1,31 @@
-from ._binary_constructor import Constructor
-from ._tokenizer import Tokenizer
-from ._compiler import Compiler
-from ._main import main
+import importlib
+
+
+# public names and the modules they are in
+# modules are only imported when their names are used, so importing the package is cheap, and has no side effects
+_LAZY_NAMES: dict[str, str] = {
+    "Constructor": "._binary_constructor",
+    "Tokenizer": "._tokenizer",
+    "Compiler": "._compiler",
+    "CompileOptions": "._api",
+    "compile_source": "._api",
+    "compile_file": "._api",
+    "main": "._main",
+}
+
+__all__ = list(_LAZY_NAMES)
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    value = getattr(importlib.import_module(_LAZY_NAMES[name], __name__), name)
+
+    # next time the name is found without calling this
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,129 @@
+from typing import Any
+from ._tokenizer import Tokenizer
+from ._asm_types import TScope
+from ._compiler import Compiler
+from ._binary_constructor import Constructor
+from ._cache import CompileCache
+from ._profile import Profiler
+
+
+class CompileOptions:
+    def __init__(self, optimize: int = 1, passes: list[str] | None = None, stream: bool = False,
+                 cache_dir: str | None = None, cache_size: int = 64):
+        """
+        Compilation options, which are used instead of parsed command line arguments,
+        when the compiler is used as a library
+        :param optimize: optimization level; 0 - none, 1 - redundant loads, 2 - all optimizations
+        :param passes: optimization passes to run, in order, instead of the ones of the optimization level
+        :param stream: compile source files one statement at a time (macros must be defined before they are used)
+        :param cache_dir: directory for caching compilation results (default is no caching);
+        streamed files are never read whole, so only their compiled macros are cached, and not their token trees
+        :param cache_size: cache size limit in MiB
+        """
+
+        if optimize not in (0, 1, 2):
+            raise ValueError(f"Unknown optimization level '{optimize}'")
+
+        self.optimize: int = optimize
+        self.passes: list[str] | None = passes
+        self.stream: bool = stream
+        self.cache_dir: str | None = cache_dir
+        self.cache_size: int = cache_size
+
+    def __repr__(self):
+        return f"CompileOptions({', '.join(f'{name}={value!r}' for name, value in vars(self).items())})"
+
+
+def make_cache(options: Any) -> CompileCache | None:
+    """
+    :param options: parsed command line arguments, or compilation options
+    :return: compile cache (None if caching is disabled)
+    """
+
+    if options.cache_dir is None:
+        return None
+    return CompileCache(options.cache_dir, options.cache_size * 2**20)
+
+
+def code_compile(code: str, args: Any, cache: CompileCache | None = None, macro_cache=None,
+                 profiler: Profiler | None = None) -> Compiler:
+    """
+    Compiles the given code.
+    :param code: code string
+    :param args: parsed command line arguments, or compilation options
+    :param cache: compile cache, for token trees and compiled macros
+    :param macro_cache: mapping of compiled macros (default is the one in compile cache)
+    :param profiler: profiler for compilation phases
+    :return: compiler, after the compilation
+    """
+
+    if profiler is None:
+        profiler = Profiler(False)
+
+    # token tree
+    token_tree = None
+    if cache is not None:
+        tree_key = cache.make_key("tree", code)
+        tree_data = cache.load(tree_key, "tree")
+        if tree_data is not None:
+            token_tree = TScope.from_data(tree_data)
+    if token_tree is None:
+        with profiler.phase("tokenize"):
+            token_list = Tokenizer.tokenize(code)
+        profiler.count("tokens", len(token_list))
+        with profiler.phase("build_token_tree"):
+            token_tree = Tokenizer.build_token_tree(token_list)
+        if cache is not None:
+            cache.store(tree_key, "tree", token_tree.to_data())
+
+    if macro_cache is None and cache is not None:
+        macro_cache = cache.macros()
+
+    compiler = Compiler(parser_args=args, macro_cache=macro_cache, profiler=profiler)
+    compiler.compile(token_tree)
+    return compiler
+
+
+def compile_source(text: str, options: CompileOptions | None = None) -> bytes:
+    """
+    Compiles the source code into an executable.
+    :param text: source code
+    :param options: compilation options (default is CompileOptions())
+    :return: executable bytes
+    """
+
+    if options is None:
+        options = CompileOptions()
+
+    compiler = code_compile(text, options, make_cache(options))
+    return bytes(Constructor.generate_bytes(compiler.includes, compiler.main))
+
+
+def compile_file(input_filename: str, output_filename: str | None = None,
+                 options: CompileOptions | None = None) -> bytes:
+    """
+    Compiles the source file into an executable.
+    :param input_filename: source file name
+    :param output_filename: executable file name (default is to not write the executable)
+    :param options: compilation options (default is CompileOptions())
+    :return: executable bytes
+    """
+
+    if options is None:
+        options = CompileOptions()
+
+    # the file is read line by line, while it's compiled
+    if options.stream:
+        cache = make_cache(options)
+        compiler = Compiler(parser_args=options, macro_cache=cache.macros() if cache is not None else None)
+        with open(input_filename, "r", encoding="utf8") as file:
+            compiler.compile_stream(file)
+        data = bytes(Constructor.generate_bytes(compiler.includes, compiler.main))
+    else:
+        with open(input_filename, "r", encoding="utf8") as file:
+            data = compile_source(file.read(), options)
+
+    if output_filename is not None:
+        with open(output_filename, "wb") as file:
+            file.write(data)
+    return data
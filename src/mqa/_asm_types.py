@@ -1,6 +1,9 @@
-from copy import deepcopy
+from sys import intern
 from enum import Enum
+from array import array
+from itertools import accumulate, compress
 from typing import Any, Iterable
+from ._mqis import InstructionSet
 
 
 class BType(Enum):
@@ -13,6 +16,8 @@ class BType(Enum):
 
 
 class Token:
+    __slots__ = ("token", "_traceback")
+
     def __init__(self, value: Any, tb: int = 0):
         """
         Special kind of string
@@ -29,12 +34,19 @@ class Token:
         return self._traceback
 
     def __eq__(self, other):
-        if isinstance(other, Token):
+        # fast path, tokens are mostly compared to strings
+        if other.__class__ is str:
+            return self.token == other
+        elif isinstance(other, Token):
             return self.token == other.token
         elif isinstance(other, str):
             return self.token == other
         return False
 
+    def __hash__(self):
+        # same hash as the held value, as tokens are equal to it
+        return hash(self.token)
+
     def __repr__(self):
         return self.token.__repr__()
 
@@ -44,11 +56,15 @@ class Label(Token):
     Special kind of token
     """
 
+    __slots__ = ()
+
     def __repr__(self):
         return f"@{self.token}"
 
 
 class Instruction:
+    __slots__ = ("opcode", "flag", "value", "_traceback")
+
     def __init__(self, opcode: str | Token, value: Any | None = None, memory_flag: bool = False, tb: int = 0):
         """
         An instruction word
@@ -74,6 +90,17 @@ class Instruction:
     def traceback(self):
         return self._traceback
 
+    def with_value(self, value: Any, memory_flag: bool | None = None):
+        """
+        Makes a copy of the instruction with a different argument
+        :param value: new argument
+        :param memory_flag: new memory flag (default is the current one)
+        :return: new instruction
+        """
+
+        return Instruction(
+            self.opcode, value, self.flag if memory_flag is None else memory_flag, self._traceback)
+
     def __repr__(self):
         if self.flag:
             return f"{self.opcode} ${self.value}"
@@ -81,6 +108,8 @@ class Instruction:
 
 
 class Pointer:
+    __slots__ = ("value",)
+
     def __init__(self, value: int):
         """
         Pointer class
@@ -182,7 +211,8 @@ class Scope:
             raise TypeError
 
     def __copy__(self):
-        return self.__class__(deepcopy(self.body), self.btype)
+        # scope contents are never modified in place, so the body items can be shared
+        return self.__class__(list(self.body), self.btype)
 
 
 class TScope(Scope):
@@ -191,6 +221,73 @@ class TScope(Scope):
     Scope that has tokens in it
     """
 
+    def replace(self, old, new):
+        """
+        Replaces old tokens with new ones.
+        Scopes are copied on write, the ones without replaced tokens are shared
+        :param old: old
+        :param new: new
+        :return: self if nothing was replaced, otherwise a new scope
+        """
+
+        body = self.body
+        for idx, token in enumerate(self.body):
+            if isinstance(token, TScope):
+                new_token = token.replace(old, new)
+                if new_token is token:
+                    continue
+            elif isinstance(token, Token) and token == old:
+                new_token = new
+            else:
+                continue
+
+            # copy the body on first write
+            if body is self.body:
+                body = list(self.body)
+            body[idx] = new_token
+
+        if body is self.body:
+            return self
+        return TScope(body, self.btype)
+
+    def to_data(self) -> dict[str, Any]:
+        """
+        Converts the scope into plain data, which can be stored as JSON
+        :return: bracket type and body, where tokens are [text, line] pairs
+        """
+
+        return {
+            "btype": self.btype.value,
+            "body": [token.to_data() if isinstance(token, TScope) else [token.token, token.traceback]
+                     for token in self.body]
+        }
+
+    @staticmethod
+    def from_data(data: dict[str, Any]) -> "TScope":
+        """
+        Converts plain data, made by 'to_data', back into the scope
+        :param data: bracket type and body
+        :return: token scope
+        """
+
+        return TScope(
+            [Token(intern(token[0]), token[1]) if isinstance(token, list) else TScope.from_data(token)
+             for token in data["body"]],
+            BType(data["btype"]))
+
+    def lines(self) -> list[int]:
+        """
+        :return: traceback lines of all the tokens in the scope and its sub-scopes
+        """
+
+        lines = []
+        for token in self.body:
+            if isinstance(token, TScope):
+                lines += token.lines()
+            else:
+                lines.append(token.traceback)
+        return lines
+
 
 class IScope(Scope):
     """
@@ -200,28 +297,240 @@ class IScope(Scope):
 
     def replace(self, old, new):
         """
-        Replaces old tokens with new ones
+        Replaces old tokens with new ones.
+        Instructions are never modified, the replaced ones are new instructions
         :param old: old
         :param new: new
-        :return: self
+        :return: self if nothing was replaced, otherwise a new scope
         """
 
-        for instruction in self.body:
+        body = self.body
+        for idx, instruction in enumerate(self.body):
             # skip labels
             if isinstance(instruction, Label):
                 continue
 
             if instruction.value == old:
-                instruction.value = new
-        return self
+                # copy the body on first write
+                if body is self.body:
+                    body = list(self.body)
+                body[idx] = instruction.with_value(new)
+
+        if body is self.body:
+            return self
+        return IScope(body, self.btype)
+
+
+class Template(IScope):
+    """
+    Instruction scope with argument slots.
+    Slots record which instructions use which argument as their value,
+    so that only those instructions are recreated when the template is instantiated
+    """
+
+    def __init__(self, body: list, btype: BType, args: list[str]):
+        super().__init__(body, btype)
+
+        self.args: list[str] = args
+
+        # argument index by its name (first one wins, same as with sequential replacing)
+        arg_index: dict[str, int] = {}
+        for idx, arg in enumerate(args):
+            arg_index.setdefault(arg, idx)
+
+        # (instruction index, argument index) pairs
+        self.slots: list[tuple[int, int]] = []
+        for idx, instruction in enumerate(body):
+            # skip labels
+            if isinstance(instruction, Label):
+                continue
+
+            if isinstance(instruction.value, str) and instruction.value in arg_index:
+                self.slots.append((idx, arg_index[instruction.value]))
+
+    def instantiate(self, values: list, scope: IScope) -> None:
+        """
+        Appends the template body to the scope, with arguments replaced by given values.
+        Instructions without arguments are shared with the template
+        :param values: values of the arguments
+        :param scope: scope to which the instructions are appended
+        """
+
+        offset = len(scope.body)
+        scope.body += self.body
+        for idx, arg in self.slots:
+            scope.body[offset + idx] = self.body[idx].with_value(values[arg])
+
+    def shift_lines(self, offset: int):
+        """
+        Makes a copy of the template, with source lines of its instructions and labels moved by the offset
+        :param offset: amount of lines
+        :return: new template
+        """
+
+        body = []
+        for item in self.body:
+            if isinstance(item, Label):
+                body.append(Label(item.token, item.traceback + offset))
+                continue
+
+            value = item.value
+            if isinstance(value, Label):
+                value = Label(value.token, value.traceback + offset)
+            body.append(Instruction(item.opcode, value, item.flag, item.traceback + offset))
+
+        # argument slots stay the same, as the instructions are in the same places
+        template = object.__new__(self.__class__)
+        vars(template).update(vars(self))
+        template.body = body
+        return template
 
+    def to_data(self) -> dict[str, Any]:
+        """
+        Converts the template into plain data, which can be stored as JSON
+        :return: arguments and body, where instructions are [opcode, value, memory flag, line] lists,
+        and labels are [name, line] pairs
+        """
+
+        body = []
+        for item in self.body:
+            if isinstance(item, Label):
+                body.append([item.token, item.traceback])
+            elif item.value.__class__ in (int, str):
+                body.append([item.opcode, item.value, item.flag, item.traceback])
+            else:
+                raise TypeError(f"Unable to convert the value '{item.value}' into data")
+
+        return {"args": self.args, "body": body}
+
+    @staticmethod
+    def from_data(data: dict[str, Any]) -> "Template":
+        """
+        Converts plain data, made by 'to_data', back into the template
+        :param data: arguments and body
+        :return: template
+        """
+
+        return Template(
+            [Label(item[0], item[1]) if len(item) == 2 else Instruction(item[0], item[1], item[2], item[3])
+             for item in data["body"]],
+            BType.MISSING, data["args"])
 
-class Macro(IScope):
+
+class Macro(Template):
     """
     A macro scope
     """
 
     def __init__(self, body: list, btype: BType, args: TScope):
-        super().__init__(body, btype)
+        super().__init__(body, btype, [arg.token for arg in args])
+
+
+class PackedScope:
+    """
+    Instruction scope of packed 16 bit words.
+    Each word is memory flag (1 bit), value (8 bits) and opcode (7 bits), same as in the executable.
+    References to labels and values that don't fit into 8 bits are kept in side tables.
+    Source line of each word is kept in a parallel array (-1 if the word has no source line)
+    """
+
+    # opcode -> mnemonic
+    mnemonics: dict[int, str] = {opcode: name for name, opcode in InstructionSet.instruction_set.items()}
+
+    def __init__(self, words: array | None = None, lines: array | None = None):
+        """
+        :param words: array of instruction words
+        :param lines: array of source lines of the words
+        """
+
+        self.words: array = words if words is not None else array("H")
+        self.lines: array = lines if lines is not None else array("i", [-1]) * len(self.words)
+
+        # label name -> index of the word it points to
+        self.labels: dict[str, int] = dict()
+
+        # word index -> name of the label the word refers to
+        self.refs: dict[int, str] = dict()
+
+        # word index -> full value, for values that don't fit into 8 bits
+        self.wide: dict[int, int] = dict()
+
+    def append(self, opcode: str, value: int, memory_flag: bool = False, line: int = -1) -> None:
+        """
+        Appends an instruction word
+        :param opcode: assembly mnemonic
+        :param value: argument that will be used
+        :param memory_flag: cache or ROM
+        :param line: source line
+        """
+
+        if value != value & 255:
+            self.wide[len(self.words)] = value
+            value &= 255
+        self.words.append(memory_flag << 15 | value << 7 | InstructionSet.instruction_set[opcode])
+        self.lines.append(line)
 
-        self.args: TScope = args
+    def append_ref(self, opcode: str, label: str, line: int = -1) -> None:
+        """
+        Appends an instruction word that refers to a label
+        :param opcode: assembly mnemonic
+        :param label: label name
+        :param line: source line
+        """
+
+        self.refs[len(self.words)] = label
+        self.words.append(InstructionSet.instruction_set[opcode])
+        self.lines.append(line)
+
+    def add_label(self, label: str) -> None:
+        """
+        Points a label at the next appended word
+        :param label: label name
+        """
+
+        self.labels[label] = len(self.words)
+
+    def filter(self, keep: bytearray):
+        """
+        Makes a new scope only with the words that are kept.
+        Labels that pointed at removed words point at the next kept word
+        :param keep: flag for each word
+        :return: new packed scope
+        """
+
+        # new index of each word (and of the end of the scope)
+        new_index = [0, *accumulate(keep)]
+
+        packed = PackedScope(array("H", compress(self.words, keep)), array("i", compress(self.lines, keep)))
+        packed.labels = {label: new_index[idx] for label, idx in self.labels.items()}
+        packed.refs = {new_index[idx]: label for idx, label in self.refs.items() if keep[idx]}
+        packed.wide = {new_index[idx]: value for idx, value in self.wide.items() if keep[idx]}
+        return packed
+
+    def decode(self, idx: int) -> Instruction:
+        """
+        Decodes one word back into an instruction
+        :param idx: word index
+        :return: instruction
+        """
+
+        word = self.words[idx]
+        if idx in self.refs:
+            value = Label(self.refs[idx])
+        else:
+            value = self.wide.get(idx, word >> 7 & 255)
+        return Instruction(self.mnemonics[word & 127], value, bool(word >> 15), self.lines[idx])
+
+    def __repr__(self):
+        return f"<{[self.decode(idx) for idx in range(len(self.words))].__repr__()}>"
+
+    def __len__(self):
+        return self.words.__len__()
+
+    def __iter__(self):
+        return (self.decode(idx) for idx in range(len(self.words)))
+
+    def __getitem__(self, item):
+        if isinstance(item, int):
+            return self.decode(item)
+        raise TypeError
@@ -1,3 +1,7 @@
+import sys
+import struct
+from array import array
+from typing import BinaryIO
 from ._asm_types import *
 from ._mqis import *
 
@@ -6,71 +10,132 @@ MQ_VERSION = b'1.1 '
 
 
 class Constructor:
+    #               |                    : 10 bytes total
+    #               | cpuVersion         : 4  bytes - "1.1 "
+    # little_endian | includeSectionSize : 2  bytes - amount of bytes in include section
+    # little_endian | assemblySectionSize: 4  bytes - amount of bytes in code
+    # little_endian | includeSectionData : N  bytes - the include data
+    # little_endian | assemblySectionData: N  bytes - the code data
+    header = struct.Struct("<4sHI")
+
     @staticmethod
-    def generate_bytes(includes: list[str], instruction_list: IScope, verbose: bool = False) -> bytes:
+    def pack_words(instruction_list: PackedScope | Iterable[Instruction]) -> array:
         """
-        Generates the executable .mqa file with header
-        :param includes: list of included extensions
-        :param instruction_list: list of instruction
-        :param verbose: should it be verbose
-        :return: bytes
+        Packs instructions into 16 bit words
+        :param instruction_list: list of instructions
+        :return: array of words
         """
 
-        #               |                    : 10 bytes total
-        #               | cpuVersion         : 4  bytes - "1.1 "
-        # little_endian | includeSectionSize : 2  bytes - amount of bytes in include section
-        # little_endian | assemblySectionSize: 4  bytes - amount of bytes in code
-        # little_endian | includeSectionData : N  bytes - the include data
-        # little_endian | assemblySectionData: N  bytes - the code data
+        # packed scopes already are words
+        if isinstance(instruction_list, PackedScope):
+            return instruction_list.words
 
-        # create data array
-        data = bytearray()
+        # make each instruction one 16 bit value
+        opcodes = InstructionSet.instruction_set
+        return array("H", [
+            instruction.flag << 15 | instruction.value << 7 | opcodes[instruction.opcode]
+            for instruction in instruction_list])
+
+    @staticmethod
+    def make_sections(includes: list[str], instruction_list: PackedScope | Iterable[Instruction]):
+        """
+        Makes the include and assembly sections
+        :param includes: list of included extensions
+        :param instruction_list: list of instructions
+        :return: include section and assembly section
+        """
 
-        # cpuVersion
-        data += MQ_VERSION
+        # includeSectionData
+        include_section = b"".join(include.encode("ASCII") + b'\n' for include in includes)
 
-        # includeSectionSize
-        data += b'--'
+        # assemblySectionData
+        words = Constructor.pack_words(instruction_list)
+        if sys.byteorder == "big":
+            words = array("H", words)
+            words.byteswap()
 
-        # assemblySectionSize
-        data += b'----'
+        return include_section, memoryview(words).cast("B")
 
-        # section start
-        section_start = len(data)
+    @staticmethod
+    def write(file: BinaryIO, includes: list[str], instruction_list: PackedScope | Iterable[Instruction],
+              verbose: bool = False) -> int:
+        """
+        Writes the executable .mqa file with header straight to the file
+        :param file: binary file
+        :param includes: list of included extensions
+        :param instruction_list: list of instructions
+        :param verbose: should it be verbose
+        :return: amount of written bytes
+        """
 
-        # includeSectionData
-        for include in includes:
-            data += include.encode("ASCII") + b'\n'
+        include_section, assembly_section = Constructor.make_sections(includes, instruction_list)
 
-        # change includeSectionSize
-        include_section_size = (len(data) - section_start)
-        data[4:6] = include_section_size.to_bytes(2, "little")
+        file.write(Constructor.header.pack(MQ_VERSION, len(include_section), len(assembly_section)))
+        file.write(include_section)
+        file.write(assembly_section)
 
-        # section start
-        section_start = len(data)
+        size = Constructor.header.size + len(include_section) + len(assembly_section)
+        if verbose:
+            Constructor.print_header(len(include_section), len(assembly_section), size)
+        return size
 
-        # assemblySectionData
-        for instruction in instruction_list:
-            # make instruction one 16 bit value
-            value = instruction.flag << 15
-            value += instruction.value << 7
-            value += InstructionSet.instruction_set[instruction.opcode]
+    @staticmethod
+    def write_into(buffer: bytearray | memoryview, includes: list[str],
+                   instruction_list: PackedScope | Iterable[Instruction], offset: int = 0,
+                   verbose: bool = False) -> int:
+        """
+        Writes the executable .mqa file with header into the buffer
+        :param buffer: writable buffer, big enough to fit the executable
+        :param includes: list of included extensions
+        :param instruction_list: list of instructions
+        :param offset: offset in the buffer
+        :param verbose: should it be verbose
+        :return: amount of written bytes
+        """
 
-            # append 2 bytes to the list
-            data += value.to_bytes(2, "little")
+        include_section, assembly_section = Constructor.make_sections(includes, instruction_list)
 
-        # change assemblySectionSize
-        assembly_section_size = len(data) - section_start
-        data[6:10] = assembly_section_size.to_bytes(4, "little")
+        Constructor.header.pack_into(buffer, offset, MQ_VERSION, len(include_section), len(assembly_section))
+        offset += Constructor.header.size
 
-        # if verbose
+        buffer = memoryview(buffer)
+        buffer[offset:offset + len(include_section)] = include_section
+        offset += len(include_section)
+        buffer[offset:offset + len(assembly_section)] = assembly_section
+
+        size = Constructor.header.size + len(include_section) + len(assembly_section)
         if verbose:
-            print("Header start:")
-            print(f"\tcpuVersion:          {MQ_VERSION.decode('ASCII').strip()}")
-            print(f"\tincludeSectionSize:  {include_section_size}")
-            print(f"\tassemblySectionSize: {assembly_section_size}")
-            print("Header end.")
-            print(f"Total size: {len(data)} bytes")
-
-        # return the data
+            Constructor.print_header(len(include_section), len(assembly_section), size)
+        return size
+
+    @staticmethod
+    def generate_bytes(includes: list[str], instruction_list: PackedScope | Iterable[Instruction],
+                       verbose: bool = False) -> bytearray:
+        """
+        Generates the executable .mqa file with header
+        :param includes: list of included extensions
+        :param instruction_list: list of instructions
+        :param verbose: should it be verbose
+        :return: bytes
+        """
+
+        include_size = sum(len(include) + 1 for include in includes)
+        data = bytearray(Constructor.header.size + include_size + len(instruction_list) * 2)
+        Constructor.write_into(data, includes, instruction_list, verbose=verbose)
         return data
+
+    @staticmethod
+    def print_header(include_section_size: int, assembly_section_size: int, size: int) -> None:
+        """
+        Prints the header information
+        :param include_section_size: amount of bytes in include section
+        :param assembly_section_size: amount of bytes in code
+        :param size: total size
+        """
+
+        print("Header start:")
+        print(f"\tcpuVersion:          {MQ_VERSION.decode('ASCII').strip()}")
+        print(f"\tincludeSectionSize:  {include_section_size}")
+        print(f"\tassemblySectionSize: {assembly_section_size}")
+        print("Header end.")
+        print(f"Total size: {size} bytes")
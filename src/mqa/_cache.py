@@ -0,0 +1,233 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Any
+from ._binary_constructor import MQ_VERSION
+from ._asm_types import Template
+
+
+def compiler_version() -> str:
+    """
+    Version of the compiler, which is the digest of its source files,
+    so that any change to the compiler invalidates the cached results
+    :return: hex digest
+    """
+
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """
+    Content addressed cache of compilation results.
+    Each entry is a file named by the hash of everything it depends on.
+    Least recently used entries are removed, once the cache exceeds its size limit
+    """
+
+    def __init__(self, directory: str, max_size: int = 64 * 2**20):
+        """
+        :param directory: cache directory
+        :param max_size: size limit in bytes
+        """
+
+        self.directory: Path = Path(directory)
+        self.max_size: int = max_size
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # compiler and CPU versions are a part of every key
+        self._version: str = compiler_version() + MQ_VERSION.decode("ASCII")
+
+        # total size of the entries, which is kept up to date by puts,
+        # so that the directory is only scanned when the cache may have to be trimmed
+        self._size: int = sum(size for _, size, _ in self._entries())
+
+    def make_key(self, *parts: str | bytes) -> str:
+        """
+        Makes a key from given parts
+        :param parts: everything the entry depends on
+        :return: key
+        """
+
+        digest = hashlib.sha256(self._version.encode("utf8"))
+        for part in parts:
+            part = part.encode("utf8") if isinstance(part, str) else part
+            # length prefix, so that parts can't be shifted between each other
+            digest.update(len(part).to_bytes(8, "little"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _path(self, key: str, kind: str) -> Path:
+        return self.directory / f"{key}.{kind}"
+
+    def get(self, key: str, kind: str) -> bytes | None:
+        """
+        Fetches an entry
+        :param key: entry key
+        :param kind: entry kind (file extension)
+        :return: entry data or None if there's no such entry
+        """
+
+        path = self._path(key, kind)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+
+        # mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, kind: str, data: bytes) -> None:
+        """
+        Stores an entry, and evicts old entries if the cache got too big
+        :param key: entry key
+        :param kind: entry kind (file extension)
+        :param data: entry data
+        """
+
+        path = self._path(key, kind)
+
+        # the entry may replace an older one
+        try:
+            self._size -= path.stat().st_size
+        except OSError:
+            pass
+
+        # write to temporary file first, so that other processes never see partially written entries
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+        self._size += len(data)
+
+        if self._size > self.max_size:
+            self.evict()
+
+    def load(self, key: str, kind: str) -> Any:
+        """
+        Fetches a JSON entry.
+        Entries are only plain data, so that reading a cache directory never runs any code
+        :param key: entry key
+        :param kind: entry kind (file extension)
+        :return: decoded data or None if there's no such entry
+        """
+
+        data = self.get(key, kind)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def store(self, key: str, kind: str, obj: Any) -> None:
+        """
+        Stores a JSON entry
+        :param key: entry key
+        :param kind: entry kind (file extension)
+        :param obj: plain data (dicts, lists, strings, numbers and booleans)
+        """
+
+        self.put(key, kind, json.dumps(obj, separators=(",", ":")).encode("utf8"))
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        """
+        :return: modification time, size and path of each entry
+        """
+
+        entries = []
+        for path in self.directory.iterdir():
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries, until the cache fits its size limit
+        """
+
+        # other processes may have changed the cache, so the total size is counted again
+        entries = self._entries()
+        self._size = sum(size for _, size, _ in entries)
+        if self._size <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            self._size -= size
+
+    def macros(self):
+        """
+        :return: mapping of compiled macros, stored in this cache
+        """
+
+        return MacroCache(self)
+
+
+class MacroCache:
+    """
+    Mapping of compiled macro templates, backed by the compile cache
+    """
+
+    def __init__(self, cache: CompileCache):
+        self._cache: CompileCache = cache
+
+    def get(self, key: str, default=None):
+        data = self._cache.load(self._cache.make_key(key), "macro")
+        return default if data is None else Template.from_data(data)
+
+    def __setitem__(self, key: str, value: Template):
+        # macros with values that can't be stored as data are not cached
+        try:
+            data = value.to_data()
+        except TypeError:
+            return
+        self._cache.store(self._cache.make_key(key), "macro", data)
+
+
+class MemoryMacroCache:
+    """
+    In-memory mapping of compiled macro templates.
+    Keeps only the macros that were used by the last successful compilation
+    """
+
+    def __init__(self):
+        self._macros: dict = dict()
+        self._used: dict = dict()
+
+    def get(self, key: str, default=None):
+        macro = self._used.get(key)
+        if macro is None:
+            macro = self._macros.get(key)
+        if macro is None:
+            return default
+        self._used[key] = macro
+        return macro
+
+    def __setitem__(self, key: str, value):
+        self._used[key] = value
+
+    def collect(self) -> None:
+        """
+        Forgets the macros which were not used since the last collection
+        """
+
+        self._macros = self._used
+        self._used = dict()
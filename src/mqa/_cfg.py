@@ -0,0 +1,176 @@
+from ._asm_types import *
+from ._mqis import *
+from ._mqis_tables import JUMP_INSTRUCTIONS
+
+
+class BasicBlock:
+    __slots__ = ("index", "start", "end", "successors", "predecessors")
+
+    def __init__(self, index: int, start: int, end: int):
+        """
+        Sequence of instructions, which is only entered at the start and only left at the end
+        :param index: block index
+        :param start: index of the first word
+        :param end: index after the last word
+        """
+
+        self.index: int = index
+        self.start: int = start
+        self.end: int = end
+
+        # indices of the blocks, to which the control flow may go from this block, and from which it may come
+        self.successors: list[int] = []
+        self.predecessors: list[int] = []
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"BasicBlock({self.index}, {self.start}..{self.end}, -> {self.successors})"
+
+
+class ControlFlowGraph:
+    """
+    Control flow graph of a packed instruction scope, with label references not yet placed.
+    Blocks start at the beginning of the code, at referenced labels, and after jumps, RET and HALT.
+    CALL is assumed to return to the next instruction
+    """
+
+    # opcodes
+    _jump = InstructionSet.instruction_set["JMP"]
+    _call = InstructionSet.instruction_set["CALL"]
+    _ret = InstructionSet.instruction_set["RET"]
+    _halt = InstructionSet.instruction_set["HALT"]
+    _jumps = {InstructionSet.instruction_set[name] for name in JUMP_INSTRUCTIONS}
+
+    def __init__(self, scope: PackedScope):
+        """
+        :param scope: packed instruction scope
+        """
+
+        self.scope: PackedScope = scope
+
+        words = scope.words
+        refs = scope.refs
+        labels = scope.labels
+
+        # jumps without label references may go anywhere
+        self.static_jumps: bool = False
+
+        # labels, whose addresses are used by other instructions than jumps, may be jumped to from anywhere
+        self.address_taken: set[str] = set()
+
+        # block leaders
+        leaders = {0}
+        for label in set(refs.values()):
+            leaders.add(labels[label])
+        for idx, word in enumerate(words):
+            opcode = word & 127
+            if opcode in self._jumps:
+                leaders.add(idx + 1)
+                if idx not in refs:
+                    self.static_jumps = True
+            elif opcode == self._ret or opcode == self._halt:
+                leaders.add(idx + 1)
+            elif idx in refs:
+                self.address_taken.add(refs[idx])
+
+        # blocks
+        starts = sorted(leader for leader in leaders if leader < len(words))
+        self.blocks: list[BasicBlock] = [
+            BasicBlock(index, start, end) for index, (start, end) in enumerate(zip(starts, [*starts[1:], len(words)]))]
+
+        # block index by the index of its first word
+        self.block_at: dict[int, int] = {block.start: block.index for block in self.blocks}
+
+        # edges
+        for block in self.blocks:
+            last = block.end - 1
+            opcode = words[last] & 127
+
+            # jump targets
+            if opcode in self._jumps and last in refs:
+                target = self.block_at.get(labels[refs[last]])
+                if target is not None:
+                    block.successors.append(target)
+
+            # falling through to the next block
+            falls_through = opcode != self._jump and opcode != self._ret and opcode != self._halt
+            if falls_through and block.end in self.block_at and self.block_at[block.end] not in block.successors:
+                block.successors.append(self.block_at[block.end])
+
+            for successor in block.successors:
+                self.blocks[successor].predecessors.append(block.index)
+
+    def entries(self) -> list[int]:
+        """
+        :return: indices of the blocks, from which the execution may start
+        """
+
+        entries = [0] if self.blocks else []
+        for label in self.address_taken:
+            block = self.block_at.get(self.scope.labels[label])
+            if block is not None:
+                entries.append(block)
+        return entries
+
+    def reachable(self) -> bytearray:
+        """
+        Finds the blocks that can be reached from the start of the code
+        :return: flag for each block, if it's reachable
+        """
+
+        reached = bytearray(len(self.blocks))
+        stack = self.entries()
+        while stack:
+            index = stack.pop()
+            if reached[index]:
+                continue
+            reached[index] = 1
+            stack += self.blocks[index].successors
+        return reached
+
+
+class DeadCodePass:
+    """
+    Removes the blocks that can't be reached from the start of the code.
+    Labels that pointed only at removed code are removed as well.
+    Nothing is removed if there are jumps without label references, as they may go anywhere
+    """
+
+    name: str = "dce"
+    level: int = 2
+
+    def __init__(self):
+        self.stats: dict[str, int] = {"unreachable_blocks": 0, "dead_labels": 0}
+
+    def run(self, scope: PackedScope) -> PackedScope:
+        """
+        :param scope: packed instruction scope, with label references not yet placed
+        :return: optimized scope
+        """
+
+        cfg = ControlFlowGraph(scope)
+        if cfg.static_jumps:
+            return scope
+
+        reached = cfg.reachable()
+        if all(reached):
+            return scope
+
+        keep = bytearray(b"\x01") * len(scope.words)
+        for block in cfg.blocks:
+            if not reached[block.index]:
+                keep[block.start:block.end] = bytes(len(block))
+                self.stats["unreachable_blocks"] += 1
+
+        # labels of the removed code
+        dead_labels = [label for label, idx in scope.labels.items() if idx < len(keep) and not keep[idx]]
+
+        scope = scope.filter(keep)
+        referenced = set(scope.refs.values())
+        for label in dead_labels:
+            if label not in referenced:
+                del scope.labels[label]
+                self.stats["dead_labels"] += 1
+        return scope
@@ -1,6 +1,17 @@
+import hashlib
+from copy import copy
+from array import array
+from bisect import bisect_left
 from argparse import Namespace
+from typing import Iterable
 from ._asm_types import *
 from ._mqis import *
+from ._mqis_tables import JUMP_INSTRUCTIONS
+from ._profile import Profiler
+from ._tokenizer import Tokenizer
+from ._passes import PassManager
+from ._data import DataEmitter
+from ._layout import crp_pages as find_crp_pages
 
 
 # all known packages
@@ -12,24 +23,54 @@ AVAILABLE_PACKAGES: set[str] = {
 
 
 class Compiler:
-    KEYWORDS: set[str] = {"FOR", "ASSIGN", "LEN", "ENUMERATE", "INCLUDE", "__WRITE_STR__"}
+    KEYWORDS: set[str] = {"FOR", "ASSIGN", "LEN", "ENUMERATE", "INCLUDE", "__WRITE_STR__", "DATA"}
     RETURNING_KEYWORDS: set[str] = {"LEN", "ENUMERATE"}
 
-    def __init__(self, parser_args: Namespace):
+    # amount of tokens compiled at once, when compiling a stream
+    STREAM_TOKENS: int = 4096
+
+    def __init__(self, parser_args: Namespace | Any = None, macro_cache: Any = None, profiler: Profiler | None = None):
         """
         The main compiler class
+        :param parser_args: parsed command line arguments, or CompileOptions (default is the default options)
+        :param macro_cache: mapping of compiled macros by their key, used to reuse macros between compilations
+        :param profiler: profiler for compilation phases (default is a disabled one)
         """
 
         self.tree: TScope | None = None
-        self.main: IScope = IScope(list(), BType.MISSING)
+        # instruction scope, packed into words once the instruction arguments are processed
+        self.main: IScope | PackedScope = IScope(list(), BType.MISSING)
         self.includes: list[str] = list()
 
         self.labels: dict[str, Pointer] = dict()
         self.macros: dict[str, dict[int, Macro]] = dict()
         self.define: dict[str, Token] = dict()
 
+        # source lines of macro definitions (name, amount of arguments, first line, last line)
+        self.macro_spans: list[tuple[str, int, int, int]] = list()
+
         self._parser = parser_args
 
+        # optimization passes, and their statistics
+        self.optimization_level: int = getattr(parser_args, "optimize", 1)
+        self.passes: list[str] = getattr(parser_args, "passes", None)
+        if self.passes is None:
+            self.passes = PassManager.default_passes(self.optimization_level)
+        self.optimization_stats: dict[str, dict[str, Any]] = dict()
+
+        # emitter of constant data, and the length of the main scope after the last emitted data
+        self.data_emitter: DataEmitter = DataEmitter()
+        self._data_end: int = -1
+
+        # length of the main scope parts that were already packed (when compiling a stream)
+        self._main_offset: int = 0
+
+        # key of the macro definitions processed so far
+        self.macro_cache = macro_cache
+        self._macro_key: str = ""
+
+        self.profiler: Profiler = profiler if profiler is not None else Profiler(False)
+
     def process_macros_and_labels(self):
         """
         Processes scope macros
@@ -44,7 +85,7 @@ class Compiler:
             # macros
             if token.token == "macro":
                 # fetch values
-                self.tree.pop()
+                macro_token = self.tree.pop()
                 macro_name = self.tree.pop()
                 macro_args = self.tree.pop()
                 macro_body = self.tree.pop()
@@ -70,35 +111,45 @@ class Compiler:
                 if len(macro_args) in self.macros[macro_name]:
                     print("WARN: macro redefinition")
 
-                # initiate a sub-compiler class for a macro
-                sub_compiler = self.make_sub_compiler()
-
-                # create a macro
-                self.macros[macro_name][len(macro_args)] = Macro(
-                    sub_compiler.compile(macro_body, False),
-                    BType.MISSING,
-                    macro_args
-                )
+                body_lines = macro_body.lines()
+                self.macro_spans.append((
+                    macro_name, len(macro_args), macro_token.traceback,
+                    body_lines[-1] if body_lines else macro_token.traceback))
+
+                # compiled macro only depends on its definition, and on definitions that came before it.
+                # source lines are kept relative to the macro, so that moving the macro around the file
+                # doesn't change its key, and the cached instructions get the lines of the current definition
+                macro = None
+                macro_start = macro_token.traceback
+                if self.macro_cache is not None:
+                    self._macro_key = hashlib.sha256(
+                        f"{self._macro_key}{self.define!r}{macro_name}{macro_args!r}{macro_body!r}"
+                        f"{[line - macro_start for line in body_lines]!r}".encode("utf8")
+                    ).hexdigest()
+                    macro = self.macro_cache.get(self._macro_key)
+                    if macro is not None:
+                        macro = macro.shift_lines(macro_start)
+
+                if macro is None:
+                    # initiate a sub-compiler class for a macro
+                    sub_compiler = self.make_sub_compiler()
+
+                    # create a macro
+                    macro = Macro(
+                        sub_compiler.compile(macro_body, False),
+                        BType.MISSING,
+                        macro_args
+                    )
+
+                    if self.macro_cache is not None:
+                        self.macro_cache[self._macro_key] = macro.shift_lines(-macro_start)
+
+                self.macros[macro_name][len(macro_args)] = macro
 
             # labels
+            # references to labels are resolved later, using the label table of the main scope
             elif token.token[-1] == ":":
-                lbl = Label(token.token[:-1], token.traceback)
-                self.tree[self.tree.pointer] = lbl
-
-                def replace(old, new, scope: TScope):
-                    for idx, t in enumerate(scope):
-                        if isinstance(t, Label):
-                            continue
-
-                        if isinstance(t, TScope):
-                            replace(old, new, t)
-                            continue
-
-                        t: Token
-                        if t.token[1:] == old:
-                            scope[idx] = new
-
-                replace(lbl, Label(lbl, token.traceback), self.tree)
+                self.tree[self.tree.pointer] = Label(token.token[:-1], token.traceback)
 
     def make_sub_compiler(self):
         """
@@ -106,43 +157,32 @@ class Compiler:
         """
 
         # initiate a sub-compiler class for a macro
-        sub_compiler = Compiler(self._parser)
+        sub_compiler = Compiler(self._parser, profiler=self.profiler)
+        sub_compiler.macro_spans = self.macro_spans
 
         # carry labels, macros and defines inside
-        sub_compiler.macros.update(deepcopy(self.macros))
-        sub_compiler.define.update(deepcopy(self.define))
+        # macros and defines are never modified, so only the containers are copied
+        sub_compiler.macros.update({name: overloads.copy() for name, overloads in self.macros.items()})
+        sub_compiler.define.update(self.define)
 
         return sub_compiler
 
-    def process_for_loop(self, args: Token | TScope, range_: Token | int | list[tuple], body: TScope) -> IScope:
+    def process_for_loop(self, args: Token | TScope, range_: Token | int | list[tuple], body: TScope) -> None:
         """
         Processes the for loop.
+        The body is compiled once into a template, and each iteration is written straight to the main scope
         :param args: argument / arguments that will be used in a for loop
         :param range_: range that will be applied to 'args'
         :param body: body of the for loop
-        :returns: instruction scope
         """
 
         # check
         if not isinstance(args, TScope) and isinstance(range_, list):
             raise SyntaxError("Unable to unpack 1 value to multiple arguments")
 
-        # create a sub-compiler
-        sub_compiler = self.make_sub_compiler()
-
-        # compile the body
-        compiled_body: IScope = sub_compiler.compile(body, False)
-
-        # TODO: make optimized for memory version
-        instruction_scope = IScope(list(), BType.MISSING)
-
         # string ranges
         if isinstance(range_, Token) and range_.token[0] == range_.token[-1] == "\"":
-            args: Token
-            for char in range_.token[1:-1]:
-                body_copy = deepcopy(compiled_body)
-                body_copy.replace(args.token, ord(char))
-                instruction_scope.unify(body_copy)
+            iterations = ((ord(char),) for char in range_.token[1:-1])
 
         # integer ranges
         elif isinstance(range_, Token):
@@ -163,34 +203,40 @@ class Compiler:
             else:
                 range__ = range(range_start - 1, range_end - 1, -1)
 
-            args: Token
-            for i in range__:
-                body_copy = deepcopy(compiled_body)
-                body_copy.replace(args.token, i)
-                instruction_scope.unify(body_copy)
+            iterations = ((i,) for i in range__)
 
         # single integer range
         elif isinstance(range_, int):
-            args: Token
-            for i in range(range_):
-                body_copy = deepcopy(compiled_body)
-                body_copy.replace(args.token, i)
-                instruction_scope.unify(body_copy)
+            iterations = ((i,) for i in range(range_))
 
         # enumerate
         elif isinstance(range_, list) and isinstance(args, TScope):
-            # yes, we assume there are only 2 args
-            for idx, char in range_:
-                body_copy = deepcopy(compiled_body)
-
-                body_copy.replace(args[0].token, idx)
-                body_copy.replace(args[1].token, ord(char))
-
-                instruction_scope.unify(body_copy)
+            iterations = ((idx, ord(char)) for idx, char in range_)
         else:
             raise NotImplementedError("Something went wrong?")
 
-        return instruction_scope
+        # names of the arguments
+        if isinstance(args, TScope):
+            arg_names = [arg.token for arg in args]
+        else:
+            arg_names = [args.token]
+
+        # check
+        if len(arg_names) != (2 if isinstance(range_, list) else 1):
+            raise SyntaxError(f"Unable to unpack values to {len(arg_names)} arguments")
+
+        # create a sub-compiler
+        sub_compiler = self.make_sub_compiler()
+
+        # compile the body into a template
+        template = Template(sub_compiler.compile(body, False).body, BType.MISSING, arg_names)
+
+        # append instructions to the list of instructions
+        iteration_count = 0
+        for values in iterations:
+            template.instantiate(values, self.main)
+            iteration_count += 1
+        self.profiler.count("for_iterations", iteration_count)
 
     def process_keyword(self, keyword: Token):
         """
@@ -213,19 +259,7 @@ class Compiler:
 
             self.define[arg.token] = to_assign
 
-            def replace(old, new, scope):
-                for idx, t in enumerate(scope):
-                    if isinstance(t, TScope):
-                        replace(old, new, t)
-                        continue
-
-                    if not isinstance(t, Token):
-                        continue
-
-                    if t == old:
-                        scope[idx] = new
-
-            replace(arg, to_assign, self.tree)
+            self.tree.body = self.tree.replace(arg, to_assign).body
 
         # for loop
         elif keyword.token == "FOR":
@@ -259,7 +293,7 @@ class Compiler:
                 raise SyntaxError("Expected a '{'")
 
             # append instructions to the list of instructions
-            self.main.unify(self.process_for_loop(args, range_, body))
+            self.process_for_loop(args, range_, body)
 
         # LEN
         elif keyword.token == "LEN":
@@ -318,45 +352,154 @@ class Compiler:
             if not (string.token[0] == string.token[-1] == "\""):
                 raise TypeError("Incorrect argument")
 
-            sorted_string = [(x, ord(y)) for x, y in enumerate(string.token[1:-1])]
-            sorted_string.sort(key=lambda x: x[1])
+            self.write_data(pointer, [ord(char) for char in string.token[1:-1]], keyword.traceback)
 
-            # just ignore empty strings
-            if len(sorted_string) == 0:
-                return
+        # DATA
+        elif keyword.token == "DATA":
+            # get the address and the values
+            pointer = self.tree.next()
+            values = self.tree.next()
 
-            acc_value = -1
-            for item in sorted_string:
-                # if the character in ACC is different
-                if acc_value != item[1]:
-                    acc_value = item[1]
-                    self.main.append(
-                        Instruction("LRA", acc_value, tb=keyword.traceback))
+            # checks
+            if not isinstance(pointer, Token):
+                raise TypeError(f"Incorrect type '{pointer.__class__}'")
+
+            try:
+                pointer = int(pointer.token, base=0)
+            except ValueError:
+                raise TypeError("Incorrect argument")
 
-                # NOTE: the address will exceed 8bit integer limit,
-                # but it will be fixed in the next step of compilation
-                address = item[0] + pointer
+            # string
+            if isinstance(values, Token) and values.token[0] == values.token[-1] == "\"":
+                values = [ord(char) for char in values.token[1:-1]]
+
+            # list of integers
+            elif isinstance(values, TScope) and values.btype is BType.SQUARE:
+                if not all(isinstance(value, Token) for value in values):
+                    raise TypeError("Data values must be integers")
+                try:
+                    values = [int(value.token, base=0) for value in values]
+                except ValueError:
+                    raise ValueError("Incorrect integer value")
+            else:
+                raise SyntaxError("Expected a string or a '['")
 
-                # append store instruction
-                self.main.append(
-                    Instruction("SRA", address, tb=keyword.traceback))
+            self.write_data(pointer, values, keyword.traceback)
 
         else:
             raise NotImplementedError(f"Keyword '{keyword.token}' is not yet implemented")
 
+    def write_data(self, pointer: int, values: list[int], tb: int = 0) -> None:
+        """
+        Appends instructions that store the values into cache memory
+        :param pointer: cache address of the first value
+        :param values: values
+        :param tb: traceback of the instructions
+        """
+
+        # the known memory is only kept for the data that directly follows
+        if self._data_end != self._main_offset + len(self.main):
+            self.data_emitter = DataEmitter()
+
+        for instruction in self.data_emitter.emit(zip(range(pointer, pointer + len(values)), values), tb):
+            self.main.append(instruction)
+        self._data_end = self._main_offset + len(self.main)
+
     def compile(self, tree: TScope, is_main=True) -> Any:
         """
         Main compile method for token scopes
         :param tree: token tree
         :param is_main: is the scope - main scope
-        :return: IScope
+        :return: IScope, or PackedScope for the main scope
         """
 
         # set input tree
-        self.tree = deepcopy(tree)
+        # the tree is only modified on the top level, sub-scopes are copied on write
+        self.tree = copy(tree)
 
         # process macros and labels
-        self.process_macros_and_labels()
+        with self.profiler.phase("process_macros_and_labels"):
+            self.process_macros_and_labels()
+
+        # expand the instructions, macros and keywords
+        with self.profiler.phase("expansion"):
+            self.expand_tree()
+
+        # sub-scopes are done here
+        if not is_main:
+            return self.main
+
+        # make the label table, process instruction arguments, and pack instructions into words
+        with self.profiler.phase("process_arguments"):
+            self.make_label_table()
+            self.main = self.process_arguments()
+
+        # optimize instructions
+        self.profiler.count("instructions_before_optimization", len(self.main))
+        with self.profiler.phase("optimize_instructions"):
+            self.optimize_instructions()
+        self.profiler.count("instructions_after_optimization", len(self.main))
+
+        # place all the labels
+        with self.profiler.phase("place_labels"):
+            self.place_labels()
+
+        return self.main
+
+    def compile_stream(self, lines: Iterable[str]) -> PackedScope:
+        """
+        Compiles the source lines a few top level statements at a time.
+        The statements are expanded and packed into words right away, so only the packed words are kept,
+        and not the token tree and the instructions of the whole program.
+        Unlike the normal compilation, macros must be defined before they are used.
+        Same as with the normal compilation, ASSIGN only replaces the names that come after it,
+        so the assignments of the previous statements are applied to each new part of the file
+        :param lines: source lines with their line endings, like an opened file
+        :return: PackedScope
+        """
+
+        packed = PackedScope()
+        with self.profiler.phase("stream"):
+            for tree in Tokenizer.iter_statements(Tokenizer.iter_tokens(lines), self.STREAM_TOKENS):
+                self.tree = tree
+
+                # process macros and labels
+                self.process_macros_and_labels()
+
+                # assignments of the previous statements
+                for name, value in self.define.items():
+                    self.tree = self.tree.replace(name, value)
+
+                # expand the instructions, and pack them
+                self.main = IScope([], BType.MISSING)
+                self.expand_tree()
+                self.make_label_table()
+                self.process_arguments(packed, False)
+                self._main_offset += len(self.main)
+
+        # labels may be referenced before they are defined
+        for label in set(packed.refs.values()):
+            if label not in self.labels:
+                raise NameError(f"Undefined label '{label}'")
+        self.main = packed
+        self.tree = None
+
+        # optimize instructions
+        self.profiler.count("instructions_before_optimization", len(self.main))
+        with self.profiler.phase("optimize_instructions"):
+            self.optimize_instructions()
+        self.profiler.count("instructions_after_optimization", len(self.main))
+
+        # place all the labels
+        with self.profiler.phase("place_labels"):
+            self.place_labels()
+
+        return self.main
+
+    def expand_tree(self):
+        """
+        Expands mnemonics, macros and keywords of the token tree into instructions
+        """
 
         self.tree.set_ptr()
         while (token := self.tree.next()) is not None:
@@ -376,7 +519,8 @@ class Compiler:
                     instruction_word.append(itoken)
                 self.main.append(Instruction(
                     instruction_word[0].token,
-                    instruction_word[1].token if len(instruction_word) > 1 else 0
+                    instruction_word[1].token if len(instruction_word) > 1 else 0,
+                    tb=instruction_word[0].traceback
                 ))
 
             # macros
@@ -386,17 +530,16 @@ class Compiler:
                 macro_args = self.tree.pop()
 
                 # checks
-                if not isinstance(macro_args, TScope) and macro_args.btype is not BType.ROUND:
+                if not isinstance(macro_args, TScope) or macro_args.btype is not BType.ROUND:
                     raise SyntaxError("Expected a '('")
 
                 if len(macro_args) not in self.macros[macro_name.token]:
                     raise NameError(f"Undefined macro {macro_name}")
 
-                macro = deepcopy(self.macros[macro_name.token][len(macro_args)])
-                arg: Token
-                for idx, arg in enumerate(macro.args):
-                    macro.replace(arg.token, macro_args[idx].token)
-                self.main.body += macro.body
+                # expand the macro template
+                self.macros[macro_name.token][len(macro_args)].instantiate(
+                    [arg.token for arg in macro_args], self.main)
+                self.profiler.count("macro_expansions")
 
             # keywords
             elif token.token in self.KEYWORDS:
@@ -405,175 +548,135 @@ class Compiler:
             else:
                 raise NameError(f"Undefined instruction '{token.token}'")
 
-        # sub-scopes are done here
-        if not is_main:
-            return deepcopy(self.main)
+    def make_label_table(self):
+        """
+        Makes a table of labels.
+        Pointers get their values when the labels are placed
+        """
 
-        # process instruction arguments
         for instruction in self.main:
-            # already processed ints and labels
-            if isinstance(instruction, Label) or isinstance(instruction.value, int | Label):
+            if not isinstance(instruction, Label):
                 continue
 
+            if instruction.token in self.labels:
+                raise NameError(f"Duplicate label '{instruction.token}'")
+            self.labels[instruction.token] = Pointer(0)
+
+    def process_arguments(self, packed: PackedScope | None = None, check_labels: bool = True) -> PackedScope:
+        """
+        Processes instruction arguments, and packs the instructions into words
+        :param packed: packed instruction scope to append to (default is a new one)
+        :param check_labels: if references to undefined labels are errors
+        :return: packed instruction scope
+        """
+
+        if packed is None:
+            packed = PackedScope()
+        for instruction in self.main:
+            # labels
+            if isinstance(instruction, Label):
+                packed.add_label(instruction.token)
+                continue
+
+            value = instruction.value
+            flag = instruction.flag
+
+            # already processed ints
+            if isinstance(value, int):
+                pass
+
             # pointers
-            if instruction.value[0] == "$":
+            elif value[0] == "$":
                 # try to convert string integer to normal integer
                 try:
-                    instruction.value = int(instruction.value[1:], base=0)
+                    value = int(value[1:], base=0)
+
+                # otherwise it's a reference to a label
                 except ValueError:
-                    raise ValueError("Incorrect pointer value")
+                    if check_labels and value[1:] not in self.labels:
+                        raise NameError(f"Undefined label '{value[1:]}'")
+                    packed.append_ref(instruction.opcode, value[1:], instruction.traceback)
+                    continue
 
                 # set memory flag to be true (as this is a pointer)
-                instruction.flag = True
+                flag = True
 
             # generic string integers
-            elif isinstance(instruction.value, str):
+            elif isinstance(value, str):
                 # try to convert string integer to normal integer
                 try:
-                    instruction.value = int(instruction.value, base=0)
+                    value = int(value, base=0)
                 except ValueError:
-                    raise ValueError("Incorrect integer value")
+                    # names are only replaced by the ASSIGN statements that come before them
+                    raise ValueError(f"Incorrect integer value '{value}' on line {instruction.traceback + 1} "
+                                     f"(names must be assigned before they are used)")
 
             # something went wrong
             else:
                 raise Exception("Something went wrong")
 
-        # optimize instructions
-        self.optimize_instructions()
-
-        # place all the labels
-        self.place_labels()
-
-        return deepcopy(self.main)
+            packed.append(instruction.opcode, value, flag, instruction.traceback)
+        return packed
 
     def optimize_instructions(self):
         """
-        Optimizes away unnecessary instructions
+        Optimizes away unnecessary instructions, using the optimization passes
         """
 
-        # value in accumulator
-        acc = 0
-
-        # is the instruction non-modifying
-        no_modify = True
+        pass_manager = PassManager(self.passes)
+        self.main = pass_manager.run(self.main)
 
-        # save the old pointer value
-        old_ptr = self.main.pointer
-        self.main.set_ptr()
-
-        while (instruction := self.main.next()) is not None:
-            # skip labels
-            if isinstance(instruction, Label):
-                continue
-
-            if instruction.opcode == "LRA":
-                # if there are no modifying instructions before previous load
-                # remove this instruction
-                if acc == instruction.value and no_modify:
-                    self.main.pop()
-
-                # update the value in the accumulator
-                acc = instruction.value
-
-                # update no_modify
-                no_modify = True
-
-            # if the instruction is not in the list of non modifying instructions
-            elif instruction.opcode not in InstructionSet.non_modifying_instructions:
-                # then set no_modify to be false, as the ACC may change
-                no_modify = False
-
-        # return back
-        self.main.set_ptr(old_ptr)
-
-    def shift_labels(self, offset: int = 1, index: int | None = None):
-        """
-        Shifts labels by given offset
-        :param offset: amount by which to shift (default is 1)
-        :param index: from which index to shift (default is self.main.pointer)
-        """
-
-        if index is None:
-            index = self.main.pointer
-
-        for lbl_id, lbl_idx in self.labels.items():
-            if lbl_idx.value > index:
-                self.labels[lbl_id].value += offset
+        self.optimization_stats = pass_manager.report
+        self.profiler.passes.update(pass_manager.report)
 
     def place_labels(self):
         """
-        Places pointers in correct places
+        Places pointers in correct places.
+        Jumps to other ROM pages need a CRP instruction before them
         """
 
-        # save old pointer value
-        old_ptr = self.main.pointer
-        self.main.set_ptr()
-
-        # label table
-        while (instruction := self.main.next()) is not None:
-            if isinstance(instruction, Label):
-                lbl: Label = self.main.pop()
-                self.labels[lbl.token] = Pointer(self.main.pointer)
-
-        # reset pointer
-        self.main.set_ptr()
-
-        # go through list of instructions, and find those which have labels as arguments
-        while (instruction := self.main.next()) is not None:
-            # if it's not a label, skip
-            if not isinstance(instruction.value, Label):
-                continue
-
-            # replace label with a pointer
-            instruction.value = self.labels[instruction.value.token]
-
-        # reset pointer
-        self.main.set_ptr()
-
-        # ROM page
-        rom_page = 0
-        new_rom_page = 0
-
-        while (instruction := self.main.next()) is not None:
-            # check if the instruction is a jump of some kind
-            if instruction.opcode in ["JMP", "JMPP", "JMPZ", "JMPN", "JMPC", "CALL"]:
-                if isinstance(instruction.value, Pointer):
-                    new_rom_page = instruction.value.value >> 8
-                else:
-                    print("WARN: don't use static jump pointers, as this may cause problems")
-                    new_rom_page = instruction.value >> 8
-
-            # check for manual rom page change instructions
-            elif instruction.opcode == "CRP":
-                new_rom_page = instruction.value
-
-            # check that the new rom page does not exceed 16 bit limit (upper 8 bits)
-            if new_rom_page > 255:
-                raise ResourceWarning("Jump index exceeds 16 bit integer limit")
-
-            # if the new rom page is not equal to current one
-            if rom_page != new_rom_page:
-                # insert new instruction
-                self.main.insert(
-                    self.main.pointer,
-                    Instruction("CRP", new_rom_page, False))
-
-                # offset all label pointers by 1
-                self.shift_labels()
-
-                # go to next instruction, and change the rom page
-                self.main.next()
-                rom_page = new_rom_page
-
-        # make everything integer
-        for instruction in self.main:
-            # replace pointer with just integer
-            if isinstance(instruction.value, Pointer):
-                instruction.value = instruction.value.value & 255
-
-            # make everything 8-bit integer
-            elif isinstance(instruction.value, int):
-                instruction.value = instruction.value & 255
-
-        # get old pointer value
-        self.main.set_ptr(old_ptr)
+        words = self.main.words
+        lines = self.main.lines
+        labels = self.main.labels
+        refs = self.main.refs
+
+        # static jumps
+        jump_opcodes = {InstructionSet.instruction_set[name] for name in JUMP_INSTRUCTIONS}
+        for idx, word in enumerate(words):
+            if word & 127 in jump_opcodes and idx not in refs:
+                print("WARN: don't use static jump pointers, as this may cause problems")
+
+        # word index -> ROM page of the CRP instruction inserted before it
+        crp_opcode = InstructionSet.instruction_set["CRP"]
+        crp_pages = find_crp_pages(self.main)
+        crp_indices = sorted(crp_pages)
+
+        def address(index: int) -> int:
+            # address of the word (or the CRP before it)
+            return index + bisect_left(crp_indices, index)
+
+        # make the final words, inserting the CRP instructions
+        # (inserted CRP instructions have the source line of the jump they are for)
+        main = array("H")
+        main_lines = array("i")
+        prev_idx = 0
+        for idx in crp_indices:
+            main += words[prev_idx:idx]
+            main.append(crp_opcode | crp_pages[idx] << 7)
+            main_lines += lines[prev_idx:idx]
+            main_lines.append(lines[idx])
+            prev_idx = idx
+        main += words[prev_idx:]
+        main_lines += lines[prev_idx:]
+
+        # replace label references with addresses
+        for idx, label in refs.items():
+            main[address(idx) + (idx in crp_pages)] |= (address(labels[label]) & 255) << 7
+
+        self.profiler.count("crp_inserted", len(crp_pages))
+
+        # label pointers become addresses
+        self.main = PackedScope(main, main_lines)
+        for label, idx in labels.items():
+            self.labels[label].value = address(idx)
+            self.main.labels[label] = address(idx)
@@ -0,0 +1,376 @@
+from array import array
+from ._asm_types import *
+from ._mqis import *
+from ._mqis_tables import JUMP_INSTRUCTIONS, CARRY_WRITING_INSTRUCTIONS, CARRY_PRESERVING_INSTRUCTIONS
+from ._cfg import ControlFlowGraph
+
+
+_opcodes = InstructionSet.instruction_set
+
+# opcodes
+LRA, SRA, CCP, LRP, CCF, CALL, INT, HALT = (
+    _opcodes[name] for name in ("LRA", "SRA", "CCP", "LRP", "CCF", "CALL", "INT", "HALT"))
+ADD, SUB, ADC, SBC, INC, DEC, AND, OR, XOR, NOT, LSC, RSC, CMP, CMPU, ABS, MUL, DIV, MOD = (
+    _opcodes[name] for name in (
+        "ADD", "SUB", "ADC", "SBC", "INC", "DEC", "AND", "OR", "XOR", "NOT", "LSC", "RSC", "CMP", "CMPU", "ABS",
+        "MUL", "DIV", "MOD"))
+
+# instructions, that only change the accumulator and the carry flag
+ARITHMETIC: set[int] = {ADD, SUB, ADC, SBC, INC, DEC, AND, OR, XOR, NOT, LSC, RSC, CMP, CMPU, ABS, MUL, DIV, MOD}
+
+# instructions, that leave the accumulator unknown, and don't change anything else that is tracked
+UNKNOWN_ACC: set[int] = {_opcodes[name] for name in ("POP", "PRR", "UI")}
+
+# instructions that don't change anything that is tracked
+NO_EFFECT: set[int] = {
+    _opcodes[name] for name in ("NOP", "PUSH", "UO", "UOC", "PRW", "CRP", "RET")} | {
+    _opcodes[name] for name in JUMP_INSTRUCTIONS if name != "CALL"}
+
+_carry_writing = {_opcodes[name] for name in CARRY_WRITING_INSTRUCTIONS}
+_carry_preserving = {_opcodes[name] for name in CARRY_PRESERVING_INSTRUCTIONS}
+
+
+def alu(opcode: int, acc: int, value: int, carry: int | None) -> tuple[int, int | None] | None:
+    """
+    Computes the result of an arithmetic instruction
+    :param opcode: opcode
+    :param acc: accumulator value
+    :param value: operand value
+    :param carry: carry flag (None if it's unknown)
+    :return: new accumulator and carry flag, or None if it can't be computed
+    """
+
+    if opcode == ADD:
+        acc += value
+        return acc & 255, acc >> 8
+    if opcode == SUB:
+        acc -= value
+        return acc & 255, int(acc < 0)
+    if opcode == INC:
+        acc += 1
+        return acc & 255, acc >> 8
+    if opcode == DEC:
+        acc -= 1
+        return acc & 255, int(acc < 0)
+    if opcode == AND:
+        return acc & value, carry
+    if opcode == OR:
+        return acc | value, carry
+    if opcode == XOR:
+        return acc ^ value, carry
+    if opcode == NOT:
+        return acc ^ 255, carry
+    if opcode == CMP:
+        left = acc - 256 if acc & 128 else acc
+        right = value - 256 if value & 128 else value
+        return (0 if left == right else 1 if left > right else 255), carry
+    if opcode == CMPU:
+        return (0 if acc == value else 1 if acc > value else 255), carry
+    if opcode == ABS:
+        return (256 - acc & 255 if acc & 128 else acc), carry
+    if opcode == MUL:
+        acc *= value
+        return acc & 255, int(acc > 255)
+    if opcode == DIV:
+        return (acc // value, 0) if value else (0, 1)
+    if opcode == MOD:
+        return (acc % value, 0) if value else (0, 1)
+
+    # the rest of the instructions use the carry flag
+    if carry is None:
+        return None
+    if opcode == ADC:
+        acc += value + carry
+        return acc & 255, acc >> 8
+    if opcode == SBC:
+        acc -= value + carry
+        return acc & 255, int(acc < 0)
+    if opcode == LSC:
+        acc = acc << 1 | carry
+        return acc & 255, acc >> 8
+    if opcode == RSC:
+        return acc >> 1 | carry << 7, acc & 1
+    return None
+
+
+class State:
+    __slots__ = ("acc", "carry", "page", "memory")
+
+    def __init__(self, acc: int | None = None, carry: int | None = None, page: int | None = None,
+                 memory: dict[int, int] | None = None):
+        """
+        Known values at some point of the code (None if the value is not known)
+        :param acc: accumulator
+        :param carry: carry flag
+        :param page: cache page
+        :param memory: cache address (with the page) -> value, for the known memory values
+        """
+
+        self.acc: int | None = acc
+        self.carry: int | None = carry
+        self.page: int | None = page
+        self.memory: dict[int, int] = memory if memory is not None else dict()
+
+    def copy(self) -> "State":
+        return State(self.acc, self.carry, self.page, dict(self.memory))
+
+    def merge(self, other: "State") -> bool:
+        """
+        Forgets the values that are different in the other state
+        :param other: other state
+        :return: True if the state has changed
+        """
+
+        changed = False
+        if self.acc is not None and self.acc != other.acc:
+            self.acc = None
+            changed = True
+        if self.carry is not None and self.carry != other.carry:
+            self.carry = None
+            changed = True
+        if self.page is not None and self.page != other.page:
+            self.page = None
+            changed = True
+        for address in [address for address, value in self.memory.items() if other.memory.get(address) != value]:
+            del self.memory[address]
+            changed = True
+        return changed
+
+    def read(self, value: int, memory_flag: int) -> int | None:
+        """
+        :param value: instruction value
+        :param memory_flag: instruction memory flag
+        :return: operand of the instruction
+        """
+
+        if not memory_flag:
+            return value
+        if self.page is None:
+            return None
+        return self.memory.get(self.page << 8 | value)
+
+    def store(self, address: int) -> None:
+        """
+        Stores the accumulator into memory
+        :param address: address in the cache page
+        """
+
+        if self.page is None:
+            # any page may be written to
+            for known in [known for known in self.memory if known & 255 == address]:
+                del self.memory[known]
+        elif self.acc is None:
+            self.memory.pop(self.page << 8 | address, None)
+        else:
+            self.memory[self.page << 8 | address] = self.acc
+
+    def execute(self, word: int, is_ref: bool) -> None:
+        """
+        Changes the state as the instruction would
+        :param word: instruction word
+        :param is_ref: if the instruction value is a label reference
+        """
+
+        opcode = word & 127
+        value = word >> 7 & 255
+        memory_flag = word >> 15
+
+        # label references are not placed yet, so their values are not known
+        if is_ref and (opcode in ARITHMETIC or opcode == CCP or opcode == SRA):
+            if opcode == SRA:
+                # any memory cell may be written to
+                self.memory.clear()
+            else:
+                self.acc = self.carry = self.page = None
+        elif opcode == LRA:
+            self.acc = None if is_ref else self.read(value, memory_flag)
+        elif opcode == SRA:
+            self.store(value)
+        elif opcode in ARITHMETIC:
+            operand = self.read(value, memory_flag)
+            result = None
+            if self.acc is not None and operand is not None:
+                result = alu(opcode, self.acc, operand, self.carry)
+            if result is not None:
+                self.acc, self.carry = result
+            else:
+                self.acc = None
+                if opcode not in _carry_preserving:
+                    self.carry = None
+        elif opcode == CCF:
+            self.carry = 0
+        elif opcode == CCP:
+            self.page = self.read(value, memory_flag)
+        elif opcode == LRP:
+            if self.acc is None or self.page is None:
+                self.acc = None
+            else:
+                self.acc = self.memory.get(self.page << 8 | self.acc)
+        elif opcode in UNKNOWN_ACC:
+            self.acc = None
+        elif opcode == INT:
+            # extensions may write into memory
+            self.memory.clear()
+            self.carry = None
+        elif opcode in NO_EFFECT or opcode == HALT:
+            pass
+        else:
+            # the rest may change anything
+            self.acc = self.carry = self.page = None
+            self.memory.clear()
+
+
+class ConstantPropagationPass:
+    """
+    Tracks the known values of the accumulator, carry flag, cache page and memory through the control flow graph.
+    States are merged at the start of the blocks, keeping only the values that are the same on all paths.
+    The execution starts with 0 in the accumulator and the cache page, anything else is unknown.
+    Removes loads and stores that don't change anything, and replaces arithmetic on known values
+    with loads of the result, if the carry flag it sets is not used
+    """
+
+    name: str = "const_prop"
+    level: int = 2
+
+    def __init__(self):
+        self.stats: dict[str, int] = {"removed_loads": 0, "removed_stores": 0, "folded": 0}
+
+    @staticmethod
+    def carry_liveness(cfg: ControlFlowGraph) -> list[bool]:
+        """
+        Finds the blocks that may use the carry flag, before setting it
+        :param cfg: control flow graph
+        :return: flag for each block, if the carry flag is used after its start
+        """
+
+        words = cfg.scope.words
+
+        # how the block uses carry flag: True - uses it, False - sets it, None - neither
+        uses: list[bool | None] = []
+        for block in cfg.blocks:
+            use = None
+            for idx in range(block.start, block.end):
+                opcode = words[idx] & 127
+                if opcode in _carry_writing or opcode == HALT:
+                    use = False
+                    break
+                if opcode not in _carry_preserving:
+                    use = True
+                    break
+            uses.append(use)
+
+        # blocks without successors, which don't end with HALT, may return to anywhere
+        live = [use is True for use in uses]
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(cfg.blocks):
+                if live[block.index] or uses[block.index] is False:
+                    continue
+                if not block.successors or any(live[successor] for successor in block.successors):
+                    live[block.index] = True
+                    changed = True
+        return live
+
+    def run(self, scope: PackedScope) -> PackedScope:
+        """
+        :param scope: packed instruction scope, with label references not yet placed
+        :return: optimized scope
+        """
+
+        cfg = ControlFlowGraph(scope)
+        if cfg.static_jumps or not cfg.blocks:
+            return scope
+
+        words = scope.words
+        refs = scope.refs
+
+        # states at the start of the blocks
+        states: list[State | None] = [None] * len(cfg.blocks)
+        states[0] = State(acc=0, page=0)
+        for entry in cfg.entries()[1:]:
+            states[entry] = State()
+
+        # propagate the states, until nothing changes
+        worklist = [0] + cfg.entries()[1:]
+        while worklist:
+            block = cfg.blocks[worklist.pop()]
+            state = states[block.index].copy()
+            for idx in range(block.start, block.end):
+                state.execute(words[idx], idx in refs)
+
+            for successor in block.successors:
+                # CALL returns with anything changed
+                if words[block.end - 1] & 127 == CALL and successor == cfg.block_at.get(block.end):
+                    out = State()
+                else:
+                    out = state
+                if states[successor] is None:
+                    states[successor] = out.copy()
+                    worklist.append(successor)
+                elif states[successor].merge(out):
+                    worklist.append(successor)
+
+        # carry flag liveness
+        live_in = self.carry_liveness(cfg)
+
+        new_words = array("H", words)
+        keep = bytearray(b"\x01") * len(words)
+        folded = set()
+        for block in cfg.blocks:
+            if states[block.index] is None:
+                continue
+
+            # is carry flag used after each instruction of the block
+            carry_used = [False] * len(block)
+            used = not block.successors or any(live_in[successor] for successor in block.successors)
+            for idx in range(block.end - 1, block.start - 1, -1):
+                carry_used[idx - block.start] = used
+                opcode = words[idx] & 127
+                if opcode in _carry_writing or opcode == HALT:
+                    used = False
+                elif opcode not in _carry_preserving:
+                    used = True
+
+            state = states[block.index].copy()
+            for idx in range(block.start, block.end):
+                word = words[idx]
+                opcode = word & 127
+                before_acc = state.acc
+                before_memory = state.memory.get(state.page << 8 | word >> 7 & 255) if state.page is not None else None
+                state.execute(word, idx in refs)
+
+                if idx in refs:
+                    continue
+
+                # load of the value that is already in the accumulator
+                if opcode == LRA and before_acc is not None and state.acc == before_acc:
+                    keep[idx] = 0
+                    self.stats["removed_loads"] += 1
+
+                # store of the value that is already in memory
+                elif opcode == SRA and before_acc is not None and before_memory == before_acc:
+                    keep[idx] = 0
+                    self.stats["removed_stores"] += 1
+
+                # arithmetic with known result
+                elif opcode in ARITHMETIC and state.acc is not None:
+                    # the known carry flag may come from an instruction that was folded,
+                    # so instructions that set it are only folded when it's not used
+                    if opcode not in _carry_preserving and carry_used[idx - block.start]:
+                        continue
+                    if state.acc == before_acc:
+                        keep[idx] = 0
+                    else:
+                        new_words[idx] = state.acc << 7 | LRA
+                        folded.add(idx)
+                    self.stats["folded"] += 1
+
+        if not folded and all(keep):
+            return scope
+
+        packed = PackedScope(new_words, scope.lines)
+        packed.labels = scope.labels
+        packed.refs = scope.refs
+        packed.wide = {idx: value for idx, value in scope.wide.items() if idx not in folded}
+        return packed.filter(keep)
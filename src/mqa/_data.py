@@ -0,0 +1,135 @@
+from typing import Any, Iterable
+from ._asm_types import *
+
+
+class DataEmitter:
+    """
+    Emits instructions that store constant data into cache memory.
+    Addresses are full 16 bit cache addresses, the cache page is changed with CCP when the data crosses a page.
+    The cache page is assumed to be 0 before the data, and is changed back to 0 after it.
+    The emitter remembers the memory cells and the accumulator value it has set,
+    so the data that directly follows doesn't store the values that are already there
+    """
+
+    def __init__(self):
+        # known accumulator value
+        self.acc: int | None = None
+
+        # cache address -> value, for the cells that are known to hold the value
+        self.memory: dict[int, int] = dict()
+
+    def emit(self, data: Iterable[tuple[int, int]], tb: int = 0) -> list[Instruction]:
+        """
+        Makes the store instructions for the data.
+        Stores are either grouped by value, loading each value once, or grouped by page, changing each page once.
+        The schedule with fewer instructions is used
+        :param data: (cache address, value) pairs, later pairs overwrite earlier ones
+        :param tb: traceback of the instructions
+        :return: list of instructions
+        """
+
+        stores = dict(data)
+        if not stores:
+            return []
+
+        if min(stores) < 0 or max(stores) > 0xFFFF:
+            raise ValueError("Data address exceeds 16 bit integer limit")
+        if min(stores.values()) < 0 or max(stores.values()) > 255:
+            raise ValueError("Data value doesn't fit into 8 bits")
+
+        # skip the cells that already hold the values
+        if self.memory:
+            stores = {address: value for address, value in stores.items() if self.memory.get(address) != value}
+            if not stores:
+                return []
+
+        # value -> page -> addresses
+        by_value: dict[int, dict[int, list[int]]] = dict()
+        for address, value in stores.items():
+            by_value.setdefault(value, dict()).setdefault(address >> 8, []).append(address)
+
+        schedule = min(self.value_major(by_value), self.page_major(by_value), key=self.size)
+
+        instructions = []
+        for opcode, value in schedule:
+            if opcode == "SRA":
+                instructions += [Instruction("SRA", address & 255, tb=tb) for address in value]
+            else:
+                instructions.append(Instruction(opcode, value, tb=tb))
+
+                # the last loaded value stays in the accumulator
+                if opcode == "LRA":
+                    self.acc = value
+
+        self.memory.update(stores)
+        return instructions
+
+    @staticmethod
+    def size(schedule: list[tuple[str, Any]]) -> int:
+        """
+        :param schedule: list of (mnemonic, value) pairs, with lists of addresses for SRA
+        :return: amount of instructions
+        """
+
+        return sum(len(value) if opcode == "SRA" else 1 for opcode, value in schedule)
+
+    def value_major(self, by_value: dict[int, dict[int, list[int]]]) -> list[tuple[str, Any]]:
+        """
+        Stores each value into all of its addresses, changing pages as needed
+        :param by_value: value -> page -> addresses
+        :return: list of (mnemonic, value) pairs, with lists of addresses for SRA
+        """
+
+        schedule = []
+        acc = self.acc
+        page = 0
+        # the value in the accumulator goes first
+        for value in sorted(by_value, key=lambda item: (item != acc, item)):
+            if acc != value:
+                schedule.append(("LRA", value))
+                acc = value
+
+            # the current page goes first
+            for value_page in sorted(by_value[value], key=lambda item: (item != page, item)):
+                if value_page != page:
+                    schedule.append(("CCP", value_page))
+                    page = value_page
+                schedule.append(("SRA", by_value[value][value_page]))
+
+        # change back to the first page
+        if page != 0:
+            schedule.append(("CCP", 0))
+        return schedule
+
+    def page_major(self, by_value: dict[int, dict[int, list[int]]]) -> list[tuple[str, Any]]:
+        """
+        Fills each page with all of its values, loading values as needed
+        :param by_value: value -> page -> addresses
+        :return: list of (mnemonic, value) pairs, with lists of addresses for SRA
+        """
+
+        # page -> value -> addresses
+        by_page: dict[int, dict[int, list[int]]] = dict()
+        for value in sorted(by_value):
+            for value_page, addresses in by_value[value].items():
+                by_page.setdefault(value_page, dict())[value] = addresses
+
+        schedule = []
+        acc = self.acc
+        page = 0
+        for value_page in sorted(by_page, key=lambda item: (item != page, item)):
+            if value_page != page:
+                schedule.append(("CCP", value_page))
+                page = value_page
+
+            # the value in the accumulator goes first
+            for value in sorted(by_page[value_page], key=lambda item: (item != acc, item)):
+                if acc != value:
+                    schedule.append(("LRA", value))
+                    acc = value
+                schedule.append(("SRA", by_page[value_page][value]))
+
+        # change back to the first page
+        if page != 0:
+            schedule.append(("CCP", 0))
+        return schedule
@@ -0,0 +1,343 @@
+from array import array
+from bisect import bisect_left
+from ._asm_types import *
+from ._mqis import *
+from ._mqis_tables import JUMP_INSTRUCTIONS
+from ._cfg import ControlFlowGraph
+
+
+# opcodes
+_crp = InstructionSet.instruction_set["CRP"]
+_jump = InstructionSet.instruction_set["JMP"]
+_ret = InstructionSet.instruction_set["RET"]
+_halt = InstructionSet.instruction_set["HALT"]
+_call = InstructionSet.instruction_set["CALL"]
+_jumps = {InstructionSet.instruction_set[name] for name in JUMP_INSTRUCTIONS}
+
+
+def crp_pages(scope: PackedScope) -> dict[int, int]:
+    """
+    Finds the jumps that need a CRP instruction before them.
+    Each inserted CRP moves the code after it, so the layout is relaxed until no more CRP instructions are needed
+    :param scope: packed instruction scope, with label references not yet placed
+    :return: word index -> ROM page of the CRP instruction inserted before it
+    """
+
+    words = scope.words
+    labels = scope.labels
+    refs = scope.refs
+
+    # jumps and manual rom page changes
+    rom_page_changes = [idx for idx, word in enumerate(words) if word & 127 in _jumps or word & 127 == _crp]
+
+    # instructions which can be jumped to
+    label_indices = set(labels.values())
+
+    # only the jumps, manual rom page changes and labels affect the ROM page
+    points = sorted(label_indices.union(rom_page_changes))
+
+    pages: dict[int, int] = {}
+    crp_indices: list[int] = []
+
+    def address(index: int) -> int:
+        # address of the word (or the CRP before it)
+        return index + bisect_left(crp_indices, index)
+
+    changed = True
+    while changed:
+        changed = False
+        crp_indices = sorted(pages)
+
+        # ROM page
+        rom_page = 0
+        for idx in points:
+            # the instruction may be jumped to, which sets the ROM page to the page of this instruction
+            if idx in label_indices and rom_page != address(idx) >> 8:
+                rom_page = None
+
+            # labels at the end of the code
+            if idx >= len(words):
+                continue
+
+            # check for manual rom page change instructions
+            if words[idx] & 127 == _crp:
+                rom_page = words[idx] >> 7 & 255
+                continue
+
+            # check if the instruction is a jump of some kind
+            if idx in refs:
+                new_rom_page = address(labels[refs[idx]]) >> 8
+            elif words[idx] & 127 in _jumps:
+                new_rom_page = scope.wide.get(idx, words[idx] >> 7 & 255) >> 8
+            else:
+                continue
+
+            # check that the new rom page does not exceed 16 bit limit (upper 8 bits)
+            if new_rom_page > 255:
+                raise ResourceWarning("Jump index exceeds 16 bit integer limit")
+
+            # if the new rom page is not equal to current one, the instruction needs a CRP
+            # (CRP instructions are never removed, so the relaxation always ends)
+            if idx in pages or rom_page != new_rom_page:
+                if idx not in pages:
+                    changed = True
+                pages[idx] = new_rom_page
+
+            # the called code may return with any ROM page, if the code doesn't fit into one
+            if words[idx] & 127 == _call and len(words) + len(pages) > 256:
+                rom_page = None
+            else:
+                rom_page = new_rom_page
+
+    return pages
+
+
+def loop_components(cfg: ControlFlowGraph) -> list[int]:
+    """
+    Finds the loops of the control flow graph, as its strongly connected components
+    :param cfg: control flow graph
+    :return: loop index of each block (-1 if the block is not in a loop)
+    """
+
+    blocks = cfg.blocks
+    index = [-1] * len(blocks)
+    low = [0] * len(blocks)
+    on_stack = bytearray(len(blocks))
+    stack: list[int] = []
+    components = [-1] * len(blocks)
+    loops = 0
+    counter = 0
+
+    for root in range(len(blocks)):
+        if index[root] != -1:
+            continue
+
+        # iterative Tarjan's algorithm, (block, next successor position) pairs
+        work = [(root, 0)]
+        while work:
+            block, position = work.pop()
+            if position == 0:
+                index[block] = low[block] = counter
+                counter += 1
+                stack.append(block)
+                on_stack[block] = 1
+
+            successors = blocks[block].successors
+            if position < len(successors):
+                work.append((block, position + 1))
+                successor = successors[position]
+                if index[successor] == -1:
+                    work.append((successor, 0))
+                elif on_stack[successor]:
+                    low[block] = min(low[block], index[successor])
+                continue
+
+            # all successors are visited
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[block])
+
+            if low[block] == index[block]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    component.append(member)
+                    if member == block:
+                        break
+
+                # single blocks are loops only if they jump to themselves
+                if len(component) > 1 or block in blocks[block].successors:
+                    for member in component:
+                        components[member] = loops
+                    loops += 1
+
+    return components
+
+
+class BlockLayoutPass:
+    """
+    Reorders the code, so that loops don't cross ROM page boundaries, as each jump to another page needs a CRP.
+    Code is moved as chains of blocks that end with JMP, RET or HALT, so falling through is never broken.
+    Chains of the same loop are put together, and a loop that would cross a page boundary is moved to the
+    next page, filling the space before it with chains that are not in loops.
+    The new layout is only kept if it needs fewer CRP instructions in loops, and not more of them in total
+    """
+
+    name: str = "layout"
+    level: int = 2
+
+    def __init__(self):
+        self.stats: dict[str, int] = {"crp_saved": 0, "loop_crp_saved": 0}
+
+    @staticmethod
+    def crp_count(scope: PackedScope, loop_jumps: set[int]) -> tuple[int, int]:
+        """
+        :param scope: packed instruction scope
+        :param loop_jumps: indices of the jumps that stay in a loop
+        :return: amount of inserted CRP instructions in loops and in total
+        """
+
+        pages = crp_pages(scope)
+        return sum(idx in loop_jumps for idx in pages), len(pages)
+
+    def run(self, scope: PackedScope) -> PackedScope:
+        """
+        :param scope: packed instruction scope, with label references not yet placed
+        :return: optimized scope
+        """
+
+        words = scope.words
+
+        # everything fits into the first ROM page
+        if len(words) <= 256:
+            return scope
+
+        # code with static jumps or manual ROM page changes can't be moved
+        cfg = ControlFlowGraph(scope)
+        if cfg.static_jumps or any(word & 127 == _crp for word in words):
+            return scope
+
+        # chains of blocks, which are only left with a jump at the end
+        chains: list[list[int]] = [[]]
+        for block in cfg.blocks:
+            chains[-1].append(block.index)
+            if words[block.end - 1] & 127 in (_jump, _ret, _halt):
+                chains.append([])
+        if not chains[-1]:
+            chains.pop()
+        if len(chains) < 3:
+            return scope
+
+        chain_of = [0] * len(cfg.blocks)
+        for chain, blocks in enumerate(chains):
+            for block in blocks:
+                chain_of[block] = chain
+
+        # jumps that stay in a loop
+        loops = loop_components(cfg)
+        loop_jumps = set()
+        for block in cfg.blocks:
+            last = block.end - 1
+            if words[last] & 127 in _jumps and last in scope.refs:
+                target = cfg.block_at.get(scope.labels[scope.refs[last]])
+                if target is not None and loops[block.index] != -1 and loops[block.index] == loops[target]:
+                    loop_jumps.add(last)
+
+        before = self.crp_count(scope, loop_jumps)
+        if before[0] == 0:
+            return scope
+
+        order = self.arrange(cfg, chains, chain_of, loops)
+        if order == list(range(len(chains))):
+            return scope
+
+        # new layout
+        new_index = [0] * (len(words) + 1)
+        new_words = array("H")
+        new_lines = array("i")
+        for chain in order:
+            start = cfg.blocks[chains[chain][0]].start
+            end = cfg.blocks[chains[chain][-1]].end
+            for idx in range(start, end):
+                new_index[idx] = len(new_words) + idx - start
+            new_words += words[start:end]
+            new_lines += scope.lines[start:end]
+        new_index[len(words)] = len(words)
+
+        packed = PackedScope(new_words, new_lines)
+        packed.labels = {label: new_index[idx] for label, idx in scope.labels.items()}
+        packed.refs = {new_index[idx]: label for idx, label in scope.refs.items()}
+        packed.wide = {new_index[idx]: value for idx, value in scope.wide.items()}
+
+        after = self.crp_count(packed, {new_index[idx] for idx in loop_jumps})
+        if after[0] > before[0] or after[1] > before[1] or after == before:
+            return scope
+
+        self.stats["loop_crp_saved"] += before[0] - after[0]
+        self.stats["crp_saved"] += before[1] - after[1]
+        return packed
+
+    @staticmethod
+    def arrange(cfg: ControlFlowGraph, chains: list[list[int]], chain_of: list[int], loops: list[int]) -> list[int]:
+        """
+        Makes the new order of the chains
+        :param cfg: control flow graph
+        :param chains: block indices of each chain
+        :param chain_of: chain index of each block
+        :param loops: loop index of each block
+        :return: chain indices in the new order
+        """
+
+        words = cfg.scope.words
+
+        # chains of the same loop make a group, the rest of the chains are groups by themselves
+        group_of = list(range(len(chains)))
+
+        def find(chain: int) -> int:
+            while group_of[chain] != chain:
+                group_of[chain] = group_of[group_of[chain]]
+                chain = group_of[chain]
+            return chain
+
+        first_chain: dict[int, int] = {}
+        for block in cfg.blocks:
+            if loops[block.index] != -1:
+                root = find(first_chain.setdefault(loops[block.index], chain_of[block.index]))
+                group_of[find(chain_of[block.index])] = root
+
+        groups: dict[int, list[int]] = {}
+        for chain in range(len(chains)):
+            groups.setdefault(find(chain), []).append(chain)
+        hot = {find(chain_of[block.index]) for block in cfg.blocks if loops[block.index] != -1}
+
+        def size(chain: int) -> int:
+            return cfg.blocks[chains[chain][-1]].end - cfg.blocks[chains[chain][0]].start
+
+        def jump_count(chain: int) -> int:
+            return sum(words[cfg.blocks[block].end - 1] & 127 in _jumps for block in chains[chain])
+
+        # the first chain is where the execution starts, and the last one may fall through to the end of the code
+        first_group = find(0)
+        last = len(chains) - 1
+        last_group = find(last) if words[cfg.blocks[chains[last][-1]].end - 1] & 127 not in (_jump, _ret, _halt) else None
+        if last_group == first_group:
+            return list(range(len(chains)))
+
+        order: list[int] = []
+        placed = bytearray(len(chains))
+        position = 0
+
+        def place(chain: int) -> None:
+            nonlocal position
+            order.append(chain)
+            placed[chain] = 1
+            position += size(chain)
+
+        for group in [first_group] + [group for group in groups if group not in (first_group, last_group)]:
+            members = groups[group]
+            if placed[members[0]]:
+                continue
+
+            # move the loop to the next page, if it fits into one
+            # (there may be a CRP instruction before each of its jumps)
+            group_size = sum(size(chain) + jump_count(chain) for chain in members)
+            if group in hot and group != first_group and group_size <= 256 and (position & 255) + group_size > 256:
+                gap = 256 - (position & 255)
+                for chain in range(members[0] + 1, len(chains)):
+                    if gap == 0:
+                        break
+                    if placed[chain] or find(chain) in hot or find(chain) == last_group or size(chain) > gap:
+                        continue
+                    gap -= size(chain)
+                    place(chain)
+
+            for chain in members:
+                place(chain)
+
+        if last_group is not None:
+            for chain in groups[last_group]:
+                if not placed[chain]:
+                    place(chain)
+
+        return order
@@ -1,36 +1,82 @@
+import io
 import os
+import sys
+import time
 import argparse
-from . import Compiler, Tokenizer, Constructor
+from argparse import Namespace
+from itertools import repeat
+from contextlib import redirect_stdout
+from ._pass_registry import PASS_CLASSES
 
+# the compiler is imported by the functions that use it, so that '--help' and argument errors are fast
 
-parser = argparse.ArgumentParser(prog="mqa", description="Compiles Mini Quantum CPU source files.")
-parser.add_argument("input", type=str, help="source file")
-parser.add_argument("-o", "--output", type=str, help="output file")
-parser.add_argument("-j", "--json", help="creates a blueprint for Scrap Mechanic", action="store_true")
-parser.add_argument("-v", "--verbose", help="verbose prints", action="store_true")
-args = parser.parse_args()
 
-
-def code_compile(code: str):
+def pass_list(value: str) -> list[str]:
     """
-    Compiles the given code.
-    :param code: code string
-    :return: instruction list
+    Parses comma separated list of optimization passes
+    :param value: argument value
+    :return: list of pass names
     """
 
-    token_list = Tokenizer.tokenize(code)
-    token_tree = Tokenizer.build_token_tree(token_list)
+    passes = [name.strip() for name in value.split(",") if name.strip()]
+    for name in passes:
+        if name not in PASS_CLASSES:
+            raise argparse.ArgumentTypeError(
+                f"unknown pass '{name}' (available passes: {', '.join(PASS_CLASSES)})")
+    return passes
 
-    compiler = Compiler(parser_args=args)
-    compiler.compile(token_tree)
 
-    # print("Instructions:")
-    # len_ = len(str(len(output)))
-    # for idx, instruction in enumerate(output):
-    #     print(f"{idx: >{len_}} | {instruction}")
-    # print("End.")
+parser = argparse.ArgumentParser(
+    prog="mqa", description="Compiles Mini Quantum CPU source files.",
+    epilog="use 'mqa build FILES... [-j JOBS]' to compile multiple files in parallel")
+parser.add_argument("input", type=str, help="source file")
+parser.add_argument("-o", "--output", type=str, help="output file")
+parser.add_argument("-j", "--json", help="creates a blueprint for Scrap Mechanic", action="store_true")
+parser.add_argument("-v", "--verbose", help="verbose prints", action="store_true")
+parser.add_argument("-O", dest="optimize", type=int, choices=[0, 1, 2], default=1,
+                    help="optimization level; 0 - none, 1 - redundant loads (default), 2 - all optimizations")
+parser.add_argument("--passes", type=pass_list, metavar="PASS,...",
+                    help=f"optimization passes to run, in order, instead of the ones of the optimization level "
+                         f"(available passes: {', '.join(PASS_CLASSES)})")
+parser.add_argument("--cache-dir", type=str,
+                    help="directory for caching compilation results (cached executables are used as they are, "
+                         "so only use a directory you trust)")
+parser.add_argument("--cache-size", type=int, default=64, help="cache size limit in MiB (default is 64)")
+parser.add_argument("--profile", type=str, nargs="?", const="-", metavar="FILE",
+                    help="writes wall time and peak memory of compilation phases as JSON to the file "
+                         "(or prints it, if no file is given)")
+parser.add_argument("-w", "--watch", help="recompile the source file every time it changes", action="store_true")
+parser.add_argument("--watch-interval", type=float, default=0.05,
+                    help="how often the source file is checked in seconds (default is 0.05)")
+parser.add_argument("--source-map", help="writes the source map next to the executable (OUTPUT.map)",
+                    action="store_true")
+parser.add_argument("--stream", help="compiles the source file one statement at a time, without reading all of it "
+                                     "into memory (macros must be defined before they are used)", action="store_true")
 
-    return compiler.main, compiler.includes
+build_parser = argparse.ArgumentParser(prog="mqa build", description="Compiles multiple Mini Quantum CPU source files.")
+build_parser.add_argument("inputs", type=str, nargs="+", help="source files")
+build_parser.add_argument("-o", "--output-dir", type=str, default=".", help="output directory")
+build_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="amount of parallel jobs")
+build_parser.add_argument("-v", "--verbose", help="verbose prints", action="store_true")
+build_parser.add_argument("-O", dest="optimize", type=int, choices=[0, 1, 2], default=1,
+                          help="optimization level; 0 - none, 1 - redundant loads (default), 2 - all optimizations")
+build_parser.add_argument("--passes", type=pass_list, metavar="PASS,...",
+                          help=f"optimization passes to run, in order, instead of the ones of the optimization level "
+                               f"(available passes: {', '.join(PASS_CLASSES)})")
+build_parser.add_argument("--cache-dir", type=str,
+                          help="directory for caching compilation results (cached executables are used as they "
+                               "are, so only use a directory you trust)")
+build_parser.add_argument("--cache-size", type=int, default=64, help="cache size limit in MiB (default is 64)")
+build_parser.add_argument("--source-map", help="writes source maps next to the executables (OUTPUT.map)",
+                          action="store_true")
+build_parser.add_argument("--stream", help="compiles the source files one statement at a time "
+                                           "(macros must be defined before they are used)", action="store_true")
+build_parser.set_defaults(json=False, profile=None)
+
+# arguments that don't change the compiled executable
+NON_OUTPUT_ARGS: set[str] = {
+    "input", "output", "verbose", "cache_dir", "cache_size", "inputs", "output_dir", "jobs", "watch",
+    "watch_interval", "profile", "source_map", "stream"}
 
 
 def die(message=None):
@@ -44,41 +90,301 @@ def die(message=None):
     exit(1)
 
 
-def main():
+def make_output_filename(input_filename: str, output_filename: str | None = None) -> str:
+    """
+    Makes the name of the executable file.
+    :param input_filename: source file name
+    :param output_filename: requested output file name
+    :return: output file name
+    """
+
+    if output_filename is None:
+        # 'compiled_{file}'
+        output_filename = "compiled_" + os.path.splitext(os.path.basename(input_filename))[0]
+        output_filename += ".mqa"
+
+    # append .mqa to end of the file, if it doesn't have it
+    if os.path.splitext(output_filename)[1] == "":
+        output_filename += ".mqa"
+
+    return output_filename
+
+
+def compile_file(input_filename: str, output_filename: str, args: Namespace):
+    """
+    Compiles the source file into an executable file.
+    :param input_filename: source file name
+    :param output_filename: executable file name
+    :param args: parsed command line arguments
+    """
+
+    from ._api import make_cache
+    from ._compiler import Compiler
+    from ._profile import Profiler
+
+    # the file is read line by line, while it's compiled
+    # (the file is never read whole, so only the compiled macros are cached)
+    if args.stream:
+        profiler = Profiler(args.profile is not None)
+        cache = make_cache(args)
+        compiler = Compiler(parser_args=args, macro_cache=cache.macros() if cache is not None else None,
+                            profiler=profiler)
+        with open(input_filename, "r", encoding="utf8") as file:
+            compiler.compile_stream(file)
+        write_output(compiler, output_filename, args, profiler, input_filename)
+        return
+
     # file reading
-    if not os.path.isfile(args.input):
-        die(f"file '{args.input}' not found")
-    with open(args.input, "r", encoding="utf8") as file:
+    with open(input_filename, "r", encoding="utf8") as file:
         code = file.read()
 
+    compile_code(code, output_filename, args, source_filename=input_filename)
+
+
+def compile_code(code: str, output_filename: str, args: Namespace, macro_cache=None,
+                 source_filename: str | None = None):
+    """
+    Compiles the code into an executable file.
+    :param code: code string
+    :param output_filename: executable file name
+    :param args: parsed command line arguments
+    :param macro_cache: mapping of compiled macros, which is kept between compilations
+    :param source_filename: source file name, written into the source map
+    """
+
+    from ._api import code_compile
+    from ._binary_constructor import Constructor
+    from ._cache import CompileCache
+    from ._profile import Profiler
+
+    source_map_filename = output_filename + ".map"
+    profiler = Profiler(args.profile is not None)
+
+    # if the same code was already compiled with the same arguments, just use the cached executable
+    cache = None
+    if args.cache_dir is not None:
+        cache = CompileCache(args.cache_dir, args.cache_size * 2**20)
+        options = sorted((name, value) for name, value in vars(args).items() if name not in NON_OUTPUT_ARGS)
+        output_key = cache.make_key("mqa", code, repr(options))
+        with profiler.phase("cache_read"):
+            data = cache.get(output_key, "mqa")
+            source_map_data = cache.get(output_key, "map") if args.source_map else None
+        if data is not None and (source_map_data is not None or not args.source_map):
+            if args.verbose:
+                print("Using cached executable")
+            with open(output_filename, "wb") as file:
+                file.write(data)
+            if source_map_data is not None:
+                with open(source_map_filename, "wb") as file:
+                    file.write(source_map_data)
+            profiler.cache_hit = True
+            write_profile(profiler, args)
+            return
+
     # compilation
-    compiler_output = code_compile(code)
+    compiler = code_compile(code, args, cache, macro_cache, profiler)
+
+    source_map = write_output(compiler, output_filename, args, profiler, source_filename)
+
+    # save the executable to the cache
+    if cache is not None:
+        cache.put(output_key, "mqa", Constructor.generate_bytes(compiler.includes, compiler.main))
+        if source_map is not None:
+            cache.put(output_key, "map", source_map.encode("utf8"))
+
+
+def write_output(compiler: "Compiler", output_filename: str, args: Namespace, profiler: "Profiler",
+                 source_filename: str | None = None) -> str | None:
+    """
+    Writes the compiled executable, and the source map and the profiling report, if they were requested.
+    :param compiler: compiler, after the compilation
+    :param output_filename: executable file name
+    :param args: parsed command line arguments
+    :param profiler: profiler of the compilation
+    :param source_filename: source file name, written into the source map
+    :return: source map JSON (None if it wasn't requested)
+    """
+
+    from ._binary_constructor import Constructor
+    from ._source_map import SourceMap
 
     # if we want to see the compiled instructions
     if args.verbose:
+        print("Optimization passes:")
+        for name, report in compiler.optimization_stats.items():
+            # pass statistics, like applied rules or saved CRP instructions
+            stats = ", ".join(
+                f"{key}: {value}" for key, value in report.items() if key not in ("removed", "time_ms") and value)
+            print(f"\t{name}: removed {report['removed']} instructions in {report['time_ms']} ms"
+                  f"{f' ({stats})' if stats else ''}")
+
         print("Instructions start:")
         # how many digits does the length of list have
-        line_count_offset = len(compiler_output[0].__len__().__str__())
-        for idx, instruction in enumerate(compiler_output[0]):
+        line_count_offset = len(compiler.main.__len__().__str__())
+        for idx, instruction in enumerate(compiler.main):
             print(f"\t{idx: >{line_count_offset}} | {instruction}")
         print("Instructions end.")
 
-    # file creation
-    output_filename = args.output
-    if output_filename is None:
-        # 'compiled_{file}'
-        output_filename = "compiled_" + os.path.splitext(os.path.basename(args.input))[0]
-        output_filename += ".mqa"
+    # write the executable to a file
+    with profiler.phase("generate_bytes"), open(output_filename, "wb") as file:
+        Constructor.write(file, compiler.includes, compiler.main, verbose=args.verbose)
 
-    # append .mqa to end of the file, if it doesn't have it
-    if os.path.splitext(output_filename)[1] == "":
-        output_filename += ".mqa"
+    # write the source map next to it
+    source_map = None
+    if args.source_map:
+        source_map = SourceMap.from_scope(compiler.main, compiler.macro_spans, source_filename).to_json()
+        with open(output_filename + ".map", "w", encoding="utf8") as file:
+            file.write(source_map)
+
+    # profiling report
+    write_profile(profiler, args)
+
+    return source_map
+
+
+def write_profile(profiler: "Profiler", args: Namespace) -> None:
+    """
+    Writes the profiling report to the file, or prints it, if it was requested
+    :param profiler: profiler of the compilation
+    :param args: parsed command line arguments
+    """
+
+    import json
+
+    if args.profile is None:
+        return
+
+    report = json.dumps(profiler.report(), indent=4)
+    if args.profile == "-":
+        print(report)
+    else:
+        with open(args.profile, "w", encoding="utf8") as file:
+            file.write(report)
+
+
+def build_job(input_filename: str, output_filename: str, args: Namespace) -> tuple[str | None, str, float]:
+    """
+    Compiles one file of a batch build. Runs in a worker process.
+    :param input_filename: source file name
+    :param output_filename: executable file name
+    :param args: parsed command line arguments
+    :return: error message (None if there was no error), printed messages, compilation time in seconds
+    """
+
+    start = time.perf_counter()
+    messages = io.StringIO()
+    try:
+        with redirect_stdout(messages):
+            compile_file(input_filename, output_filename, args)
+    except Exception as exc:
+        return f"{exc.__class__.__name__}: {exc}", messages.getvalue(), time.perf_counter() - start
+    return None, messages.getvalue(), time.perf_counter() - start
+
+
+def build(args: Namespace):
+    """
+    Compiles multiple source files in parallel, and prints the summary.
+    :param args: parsed 'build' command line arguments
+    """
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = [os.path.join(args.output_dir, make_output_filename(filename)) for filename in args.inputs]
+
+    # source files with the same name would overwrite each other's executables
+    if len(set(outputs)) != len(outputs):
+        die("multiple source files compile to the same output file")
+
+    start = time.perf_counter()
+    if args.jobs == 1 or len(args.inputs) == 1:
+        results = [build_job(filename, output, args) for filename, output in zip(args.inputs, outputs)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(build_job, args.inputs, outputs, repeat(args)))
+    total_time = time.perf_counter() - start
+
+    # summary
+    failed = 0
+    for filename, output, (error, messages, compile_time) in zip(args.inputs, outputs, results):
+        if error is None:
+            print(f"OK    {filename} -> {output} ({compile_time * 1000:.1f} ms)")
+        else:
+            failed += 1
+            print(f"FAIL  {filename} ({compile_time * 1000:.1f} ms)")
+        for line in messages.splitlines():
+            print(f"\t{line}")
+        if error is not None:
+            print(f"\tERROR: {error}")
+
+    print(f"Built {len(results) - failed} of {len(results)} files in {total_time:.2f} s ({args.jobs} jobs)")
+    if failed:
+        exit(1)
+
+
+def watch(args: Namespace):
+    """
+    Recompiles the source file every time it changes.
+    Compiled macros are kept in memory, so only the changed ones are compiled again
+    :param args: parsed command line arguments
+    """
+
+    from ._cache import MemoryMacroCache
+
+    output_filename = make_output_filename(args.input, args.output)
+    macro_cache = MemoryMacroCache()
+
+    last_mtime = None
+    last_code = None
+
+    print(f"Watching '{args.input}' (press Ctrl+C to stop)")
+    try:
+        while True:
+            try:
+                mtime = os.stat(args.input).st_mtime_ns
+            except OSError:
+                mtime = last_mtime
+
+            if mtime != last_mtime:
+                last_mtime = mtime
+                with open(args.input, "r", encoding="utf8") as file:
+                    code = file.read()
+
+                # the file may be touched without changing it
+                if code != last_code:
+                    last_code = code
+                    start = time.perf_counter()
+                    try:
+                        compile_code(code, output_filename, args, macro_cache, args.input)
+                    except Exception as exc:
+                        print(f"ERROR: {exc.__class__.__name__}: {exc}")
+                    else:
+                        macro_cache.collect()
+                        print(f"Compiled '{args.input}' -> '{output_filename}' "
+                              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+            time.sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    argv = sys.argv[1:]
+
+    # batch build
+    if argv[:1] == ["build"]:
+        build(build_parser.parse_args(argv[1:]))
+        return
+
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.input):
+        die(f"file '{args.input}' not found")
+
+    if args.watch:
+        watch(args)
+        return
 
-    # write bytes to a file
-    with open(output_filename, "wb") as file:
-        file.write(
-            Constructor.generate_bytes(compiler_output[1], compiler_output[0], verbose=args.verbose)
-        )
+    compile_file(args.input, make_output_filename(args.input, args.output), args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,56 @@
+# instruction tables used by the optimization passes
+# unlike '_mqis.py', this file is not generated, and is maintained by hand
+
+# instructions that may jump (CALL included)
+JUMP_INSTRUCTIONS: set[str] = {
+    "JMP",
+    "JMPP",
+    "JMPZ",
+    "JMPN",
+    "JMPC",
+    "CALL"
+}
+
+# instructions that use the carry flag
+CARRY_READING_INSTRUCTIONS: set[str] = {
+    "ADC",
+    "SBC",
+    "JMPC",
+    "LSC",
+    "RSC"
+}
+
+# instructions that set the carry flag, without using it
+CARRY_WRITING_INSTRUCTIONS: set[str] = {
+    "ADD",
+    "SUB",
+    "INC",
+    "DEC",
+    "CCF",
+    "MUL",
+    "DIV",
+    "MOD"
+}
+
+# instructions that don't touch the carry flag, and don't change the control flow
+CARRY_PRESERVING_INSTRUCTIONS: set[str] = {
+    "NOP",
+    "LRA",
+    "SRA",
+    "LRP",
+    "CCP",
+    "CRP",
+    "PUSH",
+    "POP",
+    "AND",
+    "OR",
+    "XOR",
+    "NOT",
+    "CMP",
+    "CMPU",
+    "ABS",
+    "UO",
+    "UOC",
+    "PRW",
+    "PRR"
+}
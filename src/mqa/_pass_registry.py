@@ -0,0 +1,9 @@
+# optimization passes, in the order they run: pass name -> module and class name
+# the registry has no imports, so that the command line help doesn't load the passes
+PASS_CLASSES: dict[str, tuple[str, str]] = {
+    "dce": ("._cfg", "DeadCodePass"),
+    "const_prop": ("._const_prop", "ConstantPropagationPass"),
+    "peephole": ("._peephole", "PeepholePass"),
+    "redundant_loads": ("._peephole", "RedundantLoadPass"),
+    "layout": ("._layout", "BlockLayoutPass"),
+}
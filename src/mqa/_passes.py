@@ -0,0 +1,74 @@
+import time
+import importlib
+from typing import Any
+from ._asm_types import *
+from ._pass_registry import PASS_CLASSES
+
+
+# registered optimization passes, in the order they run
+PASSES: dict[str, type] = {
+    name: getattr(importlib.import_module(module, __package__), class_name)
+    for name, (module, class_name) in PASS_CLASSES.items()}
+
+
+class PassManager:
+    """
+    Runs optimization passes over the packed instruction scope.
+    Each pass has a 'name', a lowest optimization 'level' at which it runs by default, 'stats' counters,
+    and a 'run(scope)' method, which makes a new scope in linear time.
+    The passes run until none of them change anything, as one pass may make more work for another one,
+    or for itself, so each pass only goes through the code once
+    """
+
+    def __init__(self, passes: list[str]):
+        """
+        :param passes: names of the passes, in the order they run
+        """
+
+        for name in passes:
+            if name not in PASSES:
+                raise ValueError(f"Unknown optimization pass '{name}'")
+        self.passes: list[Any] = [PASSES[name]() for name in passes]
+
+        # pass name -> time, amount of removed instructions and pass statistics
+        self.report: dict[str, dict[str, Any]] = {
+            name: {"time_ms": 0.0, "removed": 0} for name in passes}
+
+    @staticmethod
+    def default_passes(level: int) -> list[str]:
+        """
+        :param level: optimization level
+        :return: names of the passes that run at the optimization level
+        """
+
+        return [name for name, pass_ in PASSES.items() if pass_.level <= level]
+
+    def run(self, scope: PackedScope) -> PackedScope:
+        """
+        Runs the passes
+        :param scope: packed instruction scope, with label references not yet placed
+        :return: optimized scope
+        """
+
+        changed = True
+        while changed:
+            changed = False
+            for pass_ in self.passes:
+                applied = sum(pass_.stats.values())
+                size = len(scope)
+
+                start = time.perf_counter()
+                scope = pass_.run(scope)
+                elapsed = time.perf_counter() - start
+
+                report = self.report[pass_.name]
+                report["time_ms"] += elapsed * 1000
+                report["removed"] += size - len(scope)
+                if sum(pass_.stats.values()) != applied:
+                    changed = True
+
+        for pass_ in self.passes:
+            report = self.report[pass_.name]
+            report["time_ms"] = round(report["time_ms"], 3)
+            report.update(pass_.stats)
+        return scope
@@ -0,0 +1,274 @@
+from typing import Callable
+from ._asm_types import *
+from ._mqis import *
+from ._mqis_tables import JUMP_INSTRUCTIONS, CARRY_WRITING_INSTRUCTIONS, CARRY_PRESERVING_INSTRUCTIONS
+
+
+def jump_targets(scope: PackedScope) -> set[int]:
+    """
+    Finds the words that may be jumped to
+    :param scope: packed instruction scope, with label references not yet placed
+    :return: indices of the words that referenced labels point at
+    """
+
+    return {scope.labels[label] for label in set(scope.refs.values())}
+
+
+class PeepholeRule:
+    __slots__ = ("name", "pattern", "condition", "keep")
+
+    def __init__(self, name: str, pattern: tuple[str, ...],
+                 condition: Callable[["PeepholePass", list[int]], bool] | None = None,
+                 keep: tuple[int, ...] = ()):
+        """
+        Rule that removes instructions from a window of consecutive instructions
+        :param name: rule name, used in statistics
+        :param pattern: mnemonics of the window
+        :param condition: check that the rule applies to the window (pass, word indices) -> bool
+        :param keep: positions of the instructions in the window, which are kept
+        """
+
+        self.name: str = name
+        self.pattern: tuple[int, ...] = tuple(InstructionSet.instruction_set[opcode] for opcode in pattern)
+        self.condition: Callable[["PeepholePass", list[int]], bool] | None = condition
+        self.keep: tuple[int, ...] = keep
+
+    def __repr__(self):
+        return f"PeepholeRule({self.name})"
+
+
+class PeepholePass:
+    """
+    Threads jumps, and applies window rules once through the code.
+    Windows never cross referenced labels, as the code after them may be jumped to
+    """
+
+    name: str = "peephole"
+    level: int = 2
+
+    # opcodes
+    _jump = InstructionSet.instruction_set["JMP"]
+    _halt = InstructionSet.instruction_set["HALT"]
+    _jumps = {InstructionSet.instruction_set[name] for name in JUMP_INSTRUCTIONS}
+    _carry_writing = {InstructionSet.instruction_set[name] for name in CARRY_WRITING_INSTRUCTIONS}
+    _carry_preserving = {
+        InstructionSet.instruction_set[name] for name in CARRY_PRESERVING_INSTRUCTIONS}
+
+    def __init__(self):
+        # window rules by the opcode of the last instruction of the window
+        self.rules: dict[int, list[PeepholeRule]] = dict()
+        for rule in PEEPHOLE_RULES:
+            self.rules.setdefault(rule.pattern[-1], []).append(rule)
+        self._window_size: int = max(len(rule.pattern) for rule in PEEPHOLE_RULES)
+
+        # rule name -> how many times it was applied
+        self.stats: dict[str, int] = dict.fromkeys([rule.name for rule in PEEPHOLE_RULES] + ["jump_threading"], 0)
+
+        self.scope: PackedScope | None = None
+
+        # indices of the words that referenced labels point at
+        self.targets: set[int] = set()
+
+        # flag for each word (and the end of the code), if the carry flag is set again before it's used
+        self.carry_dead: bytearray = bytearray()
+
+    def run(self, scope: PackedScope) -> PackedScope:
+        """
+        :param scope: packed instruction scope, with label references not yet placed
+        :return: optimized scope
+        """
+
+        self.scope = scope
+        self.thread_jumps()
+        self.targets = jump_targets(scope)
+        self.carry_dead = self.carry_liveness()
+
+        keep = self.apply_window_rules()
+        if not all(keep):
+            self.scope = scope.filter(keep)
+        return self.scope
+
+    def operand(self, idx: int) -> int:
+        """
+        :param idx: word index
+        :return: full value of the word
+        """
+
+        return self.scope.wide.get(idx, self.scope.words[idx] >> 7 & 255)
+
+    def carry_liveness(self) -> bytearray:
+        """
+        Finds where the carry flag is set again, before anything uses it, going backwards through the code once
+        :return: flag for each word, and the end of the code, if the carry flag is not used from there on
+        """
+
+        words = self.scope.words
+        dead = bytearray(len(words) + 1)
+        for idx in range(len(words) - 1, -1, -1):
+            # the code after a label may be reached with a different carry flag
+            if idx in self.targets:
+                continue
+
+            opcode = words[idx] & 127
+            if opcode in self._carry_writing or opcode == self._halt:
+                dead[idx] = 1
+            elif opcode in self._carry_preserving:
+                dead[idx] = dead[idx + 1]
+        return dead
+
+    def apply_window_rules(self) -> bytearray:
+        """
+        Applies window rules once through the whole scope
+        :return: flag for each word, if it's kept
+        """
+
+        words = self.scope.words
+        keep = bytearray(b"\x01") * len(words)
+
+        # indices of the last kept words, since the last label
+        window: list[int] = []
+        for idx, word in enumerate(words):
+            if idx in self.targets:
+                window = []
+            window.append(idx)
+
+            for rule in self.rules.get(word & 127, ()):
+                size = len(rule.pattern)
+                if len(window) < size:
+                    continue
+
+                matched = window[-size:]
+                if any(words[i] & 127 != opcode for i, opcode in zip(matched, rule.pattern)):
+                    continue
+                if rule.condition is not None and not rule.condition(self, matched):
+                    continue
+
+                for position, i in enumerate(matched):
+                    if position not in rule.keep:
+                        keep[i] = 0
+                window = window[:-size] + [matched[position] for position in rule.keep]
+                self.stats[rule.name] += 1
+                break
+
+            if len(window) > self._window_size:
+                del window[0]
+
+        return keep
+
+    def thread_jumps(self) -> int:
+        """
+        Makes jumps to unconditional jumps go straight to their final target
+        :return: amount of threaded jumps
+        """
+
+        words = self.scope.words
+        labels = self.scope.labels
+        refs = self.scope.refs
+
+        threaded = 0
+        for idx, label in refs.items():
+            if words[idx] & 127 not in self._jumps:
+                continue
+
+            target = label
+            seen = {label}
+            while True:
+                target_idx = labels[target]
+                if target_idx >= len(words) or words[target_idx] & 127 != self._jump or target_idx not in refs:
+                    break
+                if refs[target_idx] in seen:
+                    break
+                target = refs[target_idx]
+                seen.add(target)
+
+            if target != label:
+                refs[idx] = target
+                threaded += 1
+
+        self.stats["jump_threading"] += threaded
+        return threaded
+
+
+class RedundantLoadPass:
+    """
+    Removes loads of the value that is already in the accumulator
+    """
+
+    name: str = "redundant_loads"
+    level: int = 1
+
+    # opcodes
+    _load = InstructionSet.instruction_set["LRA"]
+    _non_modifying = {InstructionSet.instruction_set[name] for name in InstructionSet.non_modifying_instructions}
+
+    def __init__(self):
+        self.stats: dict[str, int] = {"redundant_load": 0}
+
+    def run(self, scope: PackedScope) -> PackedScope:
+        """
+        :param scope: packed instruction scope, with label references not yet placed
+        :return: optimized scope
+        """
+
+        words = scope.words
+        refs = scope.refs
+        targets = jump_targets(scope)
+        keep = bytearray(b"\x01") * len(words)
+
+        # operand of the last load into accumulator (memory flag and value)
+        acc = 0
+
+        # is the instruction non-modifying
+        no_modify = True
+
+        for idx, word in enumerate(words):
+            # the accumulator is not known after a label
+            if idx in targets:
+                acc = None
+
+            opcode = word & 127
+            if opcode == self._load:
+                # loads of label addresses are not known until labels are placed
+                operand = word >> 7 if idx not in refs else None
+
+                # if there are no modifying instructions before previous load
+                # remove this instruction
+                if acc == operand and operand is not None and no_modify:
+                    keep[idx] = 0
+                    self.stats["redundant_load"] += 1
+
+                # update the value in the accumulator
+                acc = operand
+
+                # update no_modify
+                no_modify = True
+
+            # if the instruction is not in the list of non modifying instructions
+            elif opcode not in self._non_modifying:
+                # then set no_modify to be false, as the ACC may change
+                no_modify = False
+
+        if all(keep):
+            return scope
+        return scope.filter(keep)
+
+
+def _same_address(peephole: PeepholePass, window: list[int]) -> bool:
+    # 'LRA $x' followed by 'SRA x'
+    load, store = window
+    return (peephole.scope.words[load] >> 15 == 1 and load not in peephole.scope.refs
+            and store not in peephole.scope.refs and peephole.operand(load) == peephole.operand(store))
+
+
+def _carry_is_dead(peephole: PeepholePass, window: list[int]) -> bool:
+    # the rule changes the carry flag
+    return peephole.carry_dead[window[-1] + 1] == 1
+
+
+# window rules
+PEEPHOLE_RULES: list[PeepholeRule] = [
+    PeepholeRule("store_after_load", ("LRA", "SRA"), _same_address, keep=(0,)),
+    PeepholeRule("push_pop", ("PUSH", "POP")),
+    PeepholeRule("inc_dec", ("INC", "DEC"), _carry_is_dead),
+    PeepholeRule("dec_inc", ("DEC", "INC"), _carry_is_dead),
+]
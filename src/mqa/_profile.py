@@ -0,0 +1,103 @@
+import time
+import tracemalloc
+from typing import Any
+from contextlib import contextmanager
+
+
+class Profiler:
+    """
+    Collects wall time and peak memory of compilation phases, and counts of compiled things.
+    Only the outermost phases are measured, phases of sub-compilers are a part of them
+    """
+
+    # counters that are always in the report
+    COUNTERS: tuple[str, ...] = (
+        "tokens",
+        "macro_expansions",
+        "for_iterations",
+        "instructions_before_optimization",
+        "instructions_after_optimization",
+        "crp_inserted"
+    )
+
+    def __init__(self, enabled: bool = True):
+        """
+        :param enabled: when disabled, nothing is measured or counted
+        """
+
+        self.enabled: bool = enabled
+
+        # phase name -> measurements
+        self.phases: dict[str, dict[str, Any]] = dict()
+
+        # counter name -> count
+        self.counters: dict[str, int] = dict.fromkeys(self.COUNTERS, 0)
+
+        # optimization pass name -> its time and statistics
+        self.passes: dict[str, dict[str, Any]] = dict()
+
+        # was the executable read from the compile cache, instead of being compiled
+        self.cache_hit: bool = False
+
+        # how many phases are currently running
+        self._depth: int = 0
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measures the phase
+        :param name: phase name
+        """
+
+        if not self.enabled or self._depth > 0:
+            yield
+            return
+
+        # tracing slows everything down, so it's only on during the phases
+        # (unless something else has turned it on)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._depth -= 1
+
+            memory, peak_memory = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            self.phases[name] = {
+                "time_ms": round(elapsed * 1000, 3),
+                "peak_memory": peak_memory - start_memory,
+                "memory_delta": memory - start_memory
+            }
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+        Adds to the counter
+        :param name: counter name
+        :param amount: amount to add
+        """
+
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self) -> dict[str, Any]:
+        """
+        :return: JSON serializable report
+        """
+
+        return {
+            "cache_hit": self.cache_hit,
+            "total_time_ms": round(sum(phase["time_ms"] for phase in self.phases.values()), 3),
+            "peak_memory": max((phase["peak_memory"] for phase in self.phases.values()), default=0),
+            "phases": self.phases,
+            "counters": self.counters,
+            "passes": self.passes
+        }
@@ -0,0 +1,146 @@
+import json
+from array import array
+from bisect import bisect_right
+from typing import Any
+from ._asm_types import PackedScope
+
+
+class SourceMap:
+    """
+    Maps addresses of the executable back to the source code.
+    Source lines are run length encoded, as consecutive words mostly come from the same line.
+    Lines are 1 based, words without a source line have line 0
+    """
+
+    VERSION: int = 1
+
+    def __init__(self, lines: list[tuple[int, int]], macros: list[tuple[str, int, int, int]],
+                 labels: dict[str, int], source: str | None = None):
+        """
+        :param lines: (first address, line) runs
+        :param macros: (name, amount of arguments, first line, last line) of each macro definition
+        :param labels: label name -> address
+        :param source: source file name
+        """
+
+        self.lines: list[tuple[int, int]] = lines
+        self.macros: list[tuple[str, int, int, int]] = macros
+        self.labels: dict[str, int] = labels
+        self.source: str | None = source
+
+        self._run_starts: list[int] = [start for start, _ in lines]
+
+    @classmethod
+    def from_scope(cls, scope: PackedScope, macro_spans: list[tuple[str, int, int, int]],
+                   source: str | None = None) -> "SourceMap":
+        """
+        Makes the source map of the compiled main scope
+        :param scope: main scope, after the labels were placed
+        :param macro_spans: source lines of macro definitions, collected by the compiler (0 based)
+        :param source: source file name
+        :return: source map
+        """
+
+        runs = []
+        prev_line = None
+        for address, line in enumerate(scope.lines):
+            if line != prev_line:
+                runs.append((address, line + 1))
+                prev_line = line
+
+        macros = [(name, arg_count, first + 1, last + 1) for name, arg_count, first, last in macro_spans]
+        return cls(runs, macros, dict(scope.labels), source)
+
+    def line(self, address: int) -> int:
+        """
+        :param address: word address
+        :return: source line of the word (0 if it's unknown)
+        """
+
+        run = bisect_right(self._run_starts, address) - 1
+        return self.lines[run][1] if run >= 0 else 0
+
+    def to_json(self) -> str:
+        """
+        :return: JSON string
+        """
+
+        return json.dumps({
+            "version": self.VERSION,
+            "source": self.source,
+            "lines": self.lines,
+            "macros": [
+                {"name": name, "args": arg_count, "lines": [first, last]}
+                for name, arg_count, first, last in self.macros],
+            "labels": self.labels
+        }, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: str) -> "SourceMap":
+        """
+        :param data: JSON string
+        :return: source map
+        """
+
+        data = json.loads(data)
+        if data.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported source map version '{data.get('version')}'")
+        return cls(
+            [(start, line) for start, line in data["lines"]],
+            [(macro["name"], macro["args"], *macro["lines"]) for macro in data["macros"]],
+            data["labels"],
+            data["source"])
+
+    def profile(self, counts: list[int] | array) -> dict[str, Any]:
+        """
+        Makes a profiling report from execution counts of each address.
+        Every instruction takes one cycle, so cycles are the sum of the counts of instructions,
+        and executions are the count of the most executed instruction
+        :param counts: execution count of each address
+        :return: JSON serializable report
+        """
+
+        total = sum(counts)
+
+        def entry(cycles: int, **fields) -> dict[str, Any]:
+            return fields | {"cycles": cycles, "percent": round(cycles / total * 100, 2) if total else 0.0}
+
+        # per source line
+        line_cycles: dict[int, int] = {}
+        line_executions: dict[int, int] = {}
+        for (start, line), end in zip(self.lines, [*self._run_starts[1:], len(counts)]):
+            run = counts[start:end]
+            line_cycles[line] = line_cycles.get(line, 0) + sum(run)
+            line_executions[line] = max(line_executions.get(line, 0), max(run, default=0))
+
+        lines = [
+            entry(cycles, line=line, executions=line_executions[line])
+            for line, cycles in line_cycles.items() if cycles]
+        lines.sort(key=lambda item: item["cycles"], reverse=True)
+
+        # per macro, the lines of its definition
+        macros = []
+        for name, arg_count, first, last in self.macros:
+            cycles = sum(cycles for line, cycles in line_cycles.items() if first <= line <= last)
+            if cycles:
+                macros.append(entry(cycles, name=name, args=arg_count, lines=[first, last]))
+        macros.sort(key=lambda item: item["cycles"], reverse=True)
+
+        # per label, addresses from the label up to the next label
+        labels = []
+        addresses = sorted(set(self.labels.values()))
+        for name, start in self.labels.items():
+            next_label = bisect_right(addresses, start)
+            end = addresses[next_label] if next_label < len(addresses) else len(counts)
+            cycles = sum(counts[start:end])
+            if cycles:
+                labels.append(entry(cycles, label=name, address=start, entries=counts[start]))
+        labels.sort(key=lambda item: item["cycles"], reverse=True)
+
+        return {
+            "source": self.source,
+            "total_cycles": total,
+            "lines": lines,
+            "macros": macros,
+            "labels": labels
+        }
@@ -1,3 +1,8 @@
+import io
+import re
+from itertools import chain
+from typing import Iterable, Iterator
+from sys import intern
 from ._asm_types import *
 
 
@@ -8,6 +13,16 @@ class Tokenizer:
 
     # opposite brackets
     opposite_brackets = {"[": "]", "{": "}", "(": ")"}
+    closing_brackets = {"]", "}", ")"}
+
+    # scope types of opening brackets
+    bracket_types = {"[": BType.SQUARE, "{": BType.CURVED, "(": BType.ROUND}
+
+    # words and brackets of a line without strings
+    _plain_pattern = re.compile(r"[^ ,\[\]{}()\"']+|[\[\]{}()]")
+
+    # chunks of a line with strings: words, separators or single special characters
+    _string_pattern = re.compile(r"[^ ,\[\]{}()\"']+|[ ,]+|.")
 
     @staticmethod
     def tokenize(code: str):
@@ -17,106 +32,156 @@ class Tokenizer:
         :return: list of tokens
         """
 
-        # character pointer
-        char_ptr = [-1]
-
-        # next char function
-        def next_char() -> str | None:
-            char_ptr[0] += 1
-            if char_ptr[0] >= len(code):
-                return None
-            return code[char_ptr[0]]
-
-        # token list (not a tree yet)
         token_list: list[Token] = []
+        for line_tokens in Tokenizer.iter_line_tokens(io.StringIO(code)):
+            token_list += line_tokens
+        return token_list
 
-        # on which line of the code the pointer is
-        line_number = 0
+    @staticmethod
+    def iter_tokens(lines: Iterable[str]) -> Iterator[Token]:
+        """
+        Splits the source lines into tokens, one line at a time
+        :param lines: source lines with their line endings, like an opened file
+        :return: iterator of tokens
+        """
 
-        # if we are inside a comment
-        is_commented = False
+        return chain.from_iterable(Tokenizer.iter_line_tokens(lines))
 
-        # if we are inside a string
+    @staticmethod
+    def iter_line_tokens(lines: Iterable[str]) -> Iterator[list[Token]]:
+        """
+        Splits the source lines into tokens, yielding the tokens of each line as a list
+        :param lines: source lines with their line endings, like an opened file
+        :return: iterator of token lists
+        """
+
+        # if we are inside a string (strings may continue onto the next line)
         is_string = False
         string_type = ""
 
-        # token string (the accumulative string)
-        token_str = ""
-
-        # fetch each character and do some operations
-        while (char := next_char()) is not None:
-            # if we are inside a comment
-            if char == ";":
-                is_commented = True
-                continue
-
-            # if we hit a newline
-            if char == "\n":
-                line_number += 1
-                is_commented = False
-                if token_str != "":
-                    token_list.append(Token(token_str, line_number))
-                    token_str = ""
-                token_list.append(Token("\n", line_number))
-                continue
-
-            # skip this part of the code if it's commented
-            if is_commented:
-                continue
-
-            # if a character is a space or a comma
-            if (char == " " or char == ",") and not is_string:
-                if token_str != "":
-                    token_list.append(Token(token_str, line_number))
-                    token_str = ""
-
-            # if a character is a bracket
-            elif (char in "[]{}()") and not is_string:
-                if token_str != "":
-                    token_list.append(Token(token_str, line_number))
+        # newline is held back, as repeating newlines are replaced by the last one
+        newline = None
+
+        for line_number, line in enumerate(lines):
+            # last line of the code is the one which doesn't end with a newline
+            is_last = not line.endswith("\n")
+            if not is_last:
+                line = line[:-1]
+
+            # tokens of the line
+            token_list: list[Token] = []
+
+            # cut off the comment
+            comment = line.find(";")
+            if comment != -1:
+                line = line[:comment]
+
+            # fast path; lines without strings are split in bulk
+            if not is_string and "\"" not in line and "\'" not in line:
+                words = Tokenizer._plain_pattern.findall(line)
+                if words and line[-1] not in " ,[]{}()":
+                    token_str = words.pop()
+                else:
                     token_str = ""
-                token_list.append(Token(char, line_number))
+                # words are interned, as the same mnemonics and names are repeated all over the code
+                for word in words:
+                    token_list.append(Token(intern(word), line_number))
 
-            # if a character is a quote
-            elif char in "\"\'":
-                # add quote back, cuz too lazy to redo the compiler and tokens
-                token_str += "\""
+            # lines with strings go through chunks of characters
+            else:
+                token_str = ""
+                for match in Tokenizer._string_pattern.finditer(line):
+                    chunk = match.group()
+                    char = chunk[0]
+
+                    # if a character is a quote
+                    if char == "\"" or char == "\'":
+                        # add quote back, cuz too lazy to redo the compiler and tokens
+                        token_str += "\""
+
+                        if string_type == char or string_type == "":
+                            # if there's an escape character before the quote
+                            if match.start() > 0 and line[match.start() - 1] == "\\":
+                                continue
+
+                            # if it was already a string, then make it not a string
+                            if is_string:
+                                string_type = ""
+                            else:
+                                string_type = char
+                            is_string = not is_string
+
+                    # everything inside a string is a part of the token
+                    elif is_string:
+                        token_str += chunk
+
+                    # if a chunk is spaces or commas
+                    elif char == " " or char == ",":
+                        if token_str != "":
+                            token_list.append(Token(token_str, line_number))
+                            token_str = ""
+
+                    # if a character is a bracket
+                    elif char in "[]{}()":
+                        if token_str != "":
+                            token_list.append(Token(token_str, line_number))
+                            token_str = ""
+                        token_list.append(Token(char, line_number))
+
+                    # otherwise just add it to token string
+                    else:
+                        token_str += chunk
 
-                if string_type == char or string_type == "":
-                    # if there's an escape character before the quote
-                    if char_ptr[0] > 0 and code[char_ptr[0]-1] == "\\":
-                        continue
+            if token_str != "":
+                token_list.append(Token(intern(token_str), line_number))
 
-                    # if it was already a string, then make it not a string
-                    if is_string:
-                        string_type = ""
-                    else:
-                        string_type = char
-                    is_string = not is_string
+            if token_list:
+                if newline is not None:
+                    yield [newline]
+                    newline = None
+                yield token_list
 
-            # otherwise just add it to token string
-            else:
-                token_str += char
+            # the newline, replacing the repeating ones
+            if not is_last or token_str != "":
+                newline = Token("\n", line_number)
 
-        if token_str != "":
-            token_list.append(Token(token_str, line_number))
-            token_list.append(Token("\n", line_number))
+        if newline is not None:
+            yield [newline]
 
-        # delete the repeating newlines
-        pointer = 0
-        while pointer < (len(token_list) - 1):
-            if token_list[pointer].token == token_list[pointer + 1].token == "\n":
-                token_list.pop(pointer)
-                pointer -= 1
-            pointer += 1
+    @staticmethod
+    def iter_statements(tokens: Iterable[Token], min_tokens: int = 0) -> Iterator[TScope]:
+        """
+        Builds token trees of top level statements, one at a time.
+        A statement ends with a newline outside of brackets, so macro definitions and loops are whole statements
+        :param tokens: tokens
+        :param min_tokens: statements are grouped into one tree, until the tree has at least this many tokens
+        :return: iterator of token trees
+        """
 
-        return token_list
+        statement: list[Token] = []
+        depth = 0
+        for token in tokens:
+            statement.append(token)
+            if token.token in Tokenizer.bracket_types:
+                depth += 1
+            elif token.token in Tokenizer.closing_brackets:
+                depth -= 1
+            elif token.token == "\n" and depth == 0:
+                # empty lines are not statements
+                if len(statement) == 1:
+                    statement = []
+                elif len(statement) >= min_tokens:
+                    yield Tokenizer.build_token_tree(statement)
+                    statement = []
+
+        if statement:
+            yield Tokenizer.build_token_tree(statement)
 
     @staticmethod
     def build_token_tree(token_list: list[Token]):
         """
         Builds a tree of tokens.
-        This function is called recursively.
+        Goes through the token list once, keeping a stack of currently open scopes.
         :param token_list: list of tokens
         :return: hierarchical token structure
         """
@@ -124,53 +189,38 @@ class Tokenizer:
         # token tree
         token_tree: TScope = TScope([], BType.MISSING)
 
-        # token pointer
-        token_ptr = [-1]
-
-        # token fetching function
-        def next_token() -> Token | None:
-            token_ptr[0] += 1
-            if token_ptr[0] >= len(token_list):
-                return None
-            return token_list[token_ptr[0]]
+        # stack of open scopes, and the tokens that have opened them
+        scope_stack: list[TScope] = [token_tree]
+        bracket_stack: list[Token] = []
 
         # make a tree
-        while (token := next_token()) is not None:
-            # if the token is not a bracket => append & continue
-            if token.token not in "[]{}()":
-                token_tree.body.append(token)
-                continue
-
-            # if it's an opening bracket
-            if token.token in "[{(":
-                # local scope
-                scope = []
-
-                # bracket types
-                bracket = token.token
-                bracket_opposite = Tokenizer.opposite_brackets[bracket]
-
-                # how many brackets are nested in each other
-                nesting = 0
-
-                # go through each scope token and do a recursive call when needed
-                while (scope_token := next_token()) is not None:
-                    if scope_token.token == bracket_opposite and nesting == 0:
-                        built_token_tree = Tokenizer.build_token_tree(scope).body
-                        match bracket:
-                            case "(":
-                                token_tree.body.append(TScope(
-                                    built_token_tree, BType.ROUND))
-                            case "{":
-                                token_tree.body.append(TScope(
-                                    built_token_tree, BType.CURVED))
-                            case "[":
-                                token_tree.body.append(TScope(
-                                    built_token_tree, BType.SQUARE))
-                        break
-                    elif scope_token.token == bracket:
-                        nesting += 1
-                    elif scope_token.token == bracket_opposite:
-                        nesting -= 1
-                    scope.append(scope_token)
+        for token in token_list:
+            # if it's an opening bracket => open new scope
+            if token.token in Tokenizer.bracket_types:
+                scope = TScope([], Tokenizer.bracket_types[token.token])
+                scope_stack[-1].body.append(scope)
+                scope_stack.append(scope)
+                bracket_stack.append(token)
+
+            # if it's a closing bracket => close the current scope
+            elif token.token in Tokenizer.closing_brackets:
+                if not bracket_stack:
+                    raise SyntaxError(f"Unmatched '{token.token}' on line {token.traceback + 1}")
+
+                opening = bracket_stack.pop()
+                if Tokenizer.opposite_brackets[opening.token] != token.token:
+                    raise SyntaxError(
+                        f"Closing '{token.token}' on line {token.traceback + 1} does not match "
+                        f"'{opening.token}' on line {opening.traceback + 1}")
+                scope_stack.pop()
+
+            # otherwise => append to the current scope
+            else:
+                scope_stack[-1].body.append(token)
+
+        # check for scopes that were never closed
+        if bracket_stack:
+            opening = bracket_stack[-1]
+            raise SyntaxError(f"'{opening.token}' on line {opening.traceback + 1} was never closed")
+
         return token_tree
@@ -0,0 +1,340 @@
+"""
+Headless emulator of the MQ CPU, which runs compiled .mqa executables
+"""
+
+import sys
+import json
+import time
+import argparse
+from array import array
+from collections import deque
+from typing import Callable
+from ._binary_constructor import Constructor, MQ_VERSION
+from ._mqis import InstructionSet
+from ._asm_types import PackedScope
+from ._source_map import SourceMap
+
+
+class Emulator:
+    """
+    Emulates the MQ CPU.
+    Instructions are predecoded into arrays of opcodes and values, and executed by one dispatch loop.
+    Every instruction takes one cycle. TSE, TCE, RPL, UOCR, LRB, SRP and TAB instructions are not emulated
+    """
+
+    def __init__(self, words: array, includes: list[str] | None = None,
+                 interrupt: Callable[["Emulator"], None] | None = None, input_data: bytes = b"",
+                 count: bool = False):
+        """
+        :param words: 16 bit instruction words
+        :param includes: list of included extensions
+        :param interrupt: function called on INT instruction
+        :param input_data: bytes read by UI instruction (0 is read, once they run out)
+        :param count: count executions of each address (slows down the emulation)
+        """
+
+        self.includes: list[str] = includes if includes is not None else []
+        self.interrupt: Callable[["Emulator"], None] | None = interrupt
+        # bytes are taken from the front, which is O(1) for a deque
+        self.input_data: deque[int] = deque(input_data)
+
+        # predecoded instructions, the memory flag is the highest bit of opcode
+        self.opcodes: array = array("B", [word & 127 | (word >> 8 & 128) for word in words])
+        self.values: array = array("B", [word >> 7 & 255 for word in words])
+
+        # registers
+        self.pc: int = 0
+        self.acc: int = 0
+        self.carry: int = 0
+        self.cache_page: int = 0
+        self.rom_page: int = 0
+        self.halted: bool = False
+        self.cycles: int = 0
+
+        # cache memory, ports and stacks
+        self.memory: bytearray = bytearray(65536)
+        self.ports: bytearray = bytearray(256)
+        self.stack: list[int] = []
+        self.call_stack: list[int] = []
+
+        # printed characters
+        self.output: list[str] = []
+
+        # execution count of each address
+        self.counts: list[int] | None = [0] * len(self.opcodes) if count else None
+
+    @classmethod
+    def from_bytes(cls, data: bytes | bytearray | memoryview, **kwargs) -> "Emulator":
+        """
+        Makes an emulator from executable, generated by the constructor
+        :param data: executable bytes
+        :param kwargs: emulator arguments
+        :return: emulator
+        """
+
+        header = Constructor.header
+        if len(data) < header.size:
+            raise ValueError("Executable is too short to have a header")
+        version, include_size, assembly_size = header.unpack_from(data)
+        if version != MQ_VERSION:
+            raise ValueError(f"Unsupported CPU version '{version.decode('ASCII', 'replace').strip()}'")
+        if len(data) != header.size + include_size + assembly_size or assembly_size % 2:
+            raise ValueError("Section sizes in the header don't match the executable")
+
+        include_section = bytes(data[header.size:header.size + include_size])
+        includes = include_section.decode("ASCII").splitlines()
+
+        words = array("H", bytes(data[header.size + include_size:]))
+        if sys.byteorder == "big":
+            words.byteswap()
+        return cls(words, includes, **kwargs)
+
+    @classmethod
+    def from_file(cls, filename: str, **kwargs) -> "Emulator":
+        """
+        Makes an emulator from executable file
+        :param filename: executable filename
+        :param kwargs: emulator arguments
+        :return: emulator
+        """
+
+        with open(filename, "rb") as file:
+            return cls.from_bytes(file.read(), **kwargs)
+
+    def run(self, max_cycles: int | None = None) -> int:
+        """
+        Runs the program until HALT instruction, or until cycle limit is reached
+        :param max_cycles: cycle limit
+        :return: amount of executed cycles
+        """
+
+        if self.halted:
+            return 0
+
+        opcodes = self.opcodes.tolist()
+        values = self.values.tolist()
+        memory = self.memory
+        ports = self.ports
+        stack = self.stack
+        call_stack = self.call_stack
+        output = self.output
+        counts = self.counts
+
+        # opcodes
+        (LRA, SRA, CALL, RET, JMP, JMPP, JMPZ, JMPN, JMPC, CCF, LRP, CCP, CRP, PUSH, POP, AND, OR, XOR, NOT, LSC,
+         RSC, CMP, CMPU, ADC, SBC, INC, DEC, ABS, MUL, DIV, MOD, ADD, SUB, UI, UO, UOC, PRW, PRR, INT, HALT) = (
+            InstructionSet.instruction_set[name] for name in (
+                "LRA", "SRA", "CALL", "RET", "JMP", "JMPP", "JMPZ", "JMPN", "JMPC", "CCF", "LRP", "CCP", "CRP",
+                "PUSH", "POP", "AND", "OR", "XOR", "NOT", "LSC", "RSC", "CMP", "CMPU", "ADC", "SBC", "INC", "DEC",
+                "ABS", "MUL", "DIV", "MOD", "ADD", "SUB", "UI", "UO", "UOC", "PRW", "PRR", "INT", "HALT"))
+        NOP = InstructionSet.instruction_set["NOP"]
+
+        pc = self.pc
+        acc = self.acc
+        carry = self.carry
+        cache_base = self.cache_page << 8
+        rom_base = self.rom_page << 8
+        start_pc = pc
+
+        cycles = 0
+        limit = -1 if max_cycles is None else max_cycles
+        try:
+            while cycles != limit:
+                start_pc = pc
+                opcode = opcodes[pc]
+                value = values[pc]
+                pc += 1
+                cycles += 1
+                if counts is not None:
+                    counts[start_pc] += 1
+
+                # SRA always uses its value as address
+                if opcode & 128:
+                    opcode &= 127
+                    if opcode != SRA:
+                        value = memory[cache_base | value]
+
+                # ordered by how common the instructions are
+                if opcode == LRA:
+                    acc = value
+                elif opcode == SRA:
+                    memory[cache_base | value] = acc
+                elif opcode == ADD:
+                    acc += value
+                    carry = acc >> 8
+                    acc &= 255
+                elif opcode == SUB:
+                    acc -= value
+                    carry = 1 if acc < 0 else 0
+                    acc &= 255
+                elif opcode == ADC:
+                    acc += value + carry
+                    carry = acc >> 8
+                    acc &= 255
+                elif opcode == SBC:
+                    acc -= value + carry
+                    carry = 1 if acc < 0 else 0
+                    acc &= 255
+                elif opcode == INC:
+                    acc += 1
+                    carry = acc >> 8
+                    acc &= 255
+                elif opcode == DEC:
+                    acc -= 1
+                    carry = 1 if acc < 0 else 0
+                    acc &= 255
+                elif opcode == JMP:
+                    pc = rom_base | value
+                elif opcode == JMPZ:
+                    if acc == 0:
+                        pc = rom_base | value
+                elif opcode == JMPN:
+                    if acc & 128:
+                        pc = rom_base | value
+                elif opcode == JMPP:
+                    if not acc & 128:
+                        pc = rom_base | value
+                elif opcode == JMPC:
+                    if carry:
+                        pc = rom_base | value
+                elif opcode == CRP:
+                    rom_base = value << 8
+                elif opcode == CCP:
+                    cache_base = value << 8
+                elif opcode == CCF:
+                    carry = 0
+                elif opcode == LRP:
+                    acc = memory[cache_base | acc]
+                elif opcode == PUSH:
+                    stack.append(acc)
+                elif opcode == POP:
+                    acc = stack.pop()
+                elif opcode == CALL:
+                    call_stack.append(pc)
+                    pc = rom_base | value
+                elif opcode == RET:
+                    pc = call_stack.pop()
+                elif opcode == AND:
+                    acc &= value
+                elif opcode == OR:
+                    acc |= value
+                elif opcode == XOR:
+                    acc ^= value
+                elif opcode == NOT:
+                    acc ^= 255
+                elif opcode == LSC:
+                    acc = acc << 1 | carry
+                    carry = acc >> 8
+                    acc &= 255
+                elif opcode == RSC:
+                    acc, carry = acc >> 1 | carry << 7, acc & 1
+                elif opcode == CMP:
+                    # compares signed values
+                    left = acc - 256 if acc & 128 else acc
+                    right = value - 256 if value & 128 else value
+                    acc = 0 if left == right else 1 if left > right else 255
+                elif opcode == CMPU:
+                    acc = 0 if acc == value else 1 if acc > value else 255
+                elif opcode == ABS:
+                    if acc & 128:
+                        acc = 256 - acc & 255
+                elif opcode == MUL:
+                    acc *= value
+                    carry = 1 if acc > 255 else 0
+                    acc &= 255
+                elif opcode == DIV:
+                    # division by zero sets the carry
+                    carry = 0 if value else 1
+                    acc = acc // value if value else 0
+                elif opcode == MOD:
+                    carry = 0 if value else 1
+                    acc = acc % value if value else 0
+                elif opcode == UO:
+                    output.append(str(acc))
+                elif opcode == UOC:
+                    output.append(chr(acc))
+                elif opcode == UI:
+                    acc = self.input_data.popleft() if self.input_data else 0
+                elif opcode == PRW:
+                    ports[value] = acc
+                elif opcode == PRR:
+                    acc = ports[value]
+                elif opcode == INT:
+                    if self.interrupt is not None:
+                        self.pc, self.acc, self.carry = pc, acc, carry
+                        self.interrupt(self)
+                        acc, carry = self.acc, self.carry
+                elif opcode == HALT:
+                    pc = start_pc
+                    self.halted = True
+                    break
+                elif opcode != NOP:
+                    name = PackedScope.mnemonics.get(opcode, str(opcode))
+                    raise RuntimeError(f"Unsupported instruction '{name}' at {start_pc}")
+        except IndexError:
+            if start_pc >= len(opcodes):
+                raise RuntimeError(f"Execution ran past the end of the program at {start_pc}") from None
+            raise RuntimeError(f"Stack underflow at {start_pc}") from None
+        finally:
+            self.pc = pc
+            self.acc = acc
+            self.carry = carry
+            self.cache_page = cache_base >> 8
+            self.rom_page = rom_base >> 8
+            self.cycles += cycles
+
+        return cycles
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m mqa.emulator", description="Runs compiled MQ executables.")
+    parser.add_argument("input", type=str, help="executable file")
+    parser.add_argument("-c", "--max-cycles", type=int, help="cycle limit")
+    parser.add_argument("-v", "--verbose", help="prints registers and execution speed", action="store_true")
+    parser.add_argument("--profile", type=str, nargs="?", const="-", metavar="FILE",
+                        help="writes cycles per source line, macro and label as JSON to the file "
+                             "(or prints it, if no file is given)")
+    parser.add_argument("--source-map", type=str, metavar="FILE",
+                        help="source map of the executable, made with 'mqa --source-map' (default is INPUT.map)")
+    args = parser.parse_args()
+
+    try:
+        emulator = Emulator.from_file(args.input, count=args.profile is not None)
+        source_map = None
+        if args.profile is not None:
+            with open(args.source_map or args.input + ".map", "r", encoding="utf8") as file:
+                source_map = SourceMap.from_json(file.read())
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        exit(1)
+
+    start = time.perf_counter()
+    try:
+        emulator.run(args.max_cycles)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        exit(1)
+    finally:
+        elapsed = time.perf_counter() - start
+        if emulator.output:
+            print("".join(emulator.output))
+
+    state = "halted" if emulator.halted else "stopped at cycle limit"
+    print(f"Program {state} after {emulator.cycles} cycles")
+    if args.verbose:
+        print(f"\tpc: {emulator.pc}  acc: {emulator.acc}  carry: {emulator.carry}  "
+              f"cache page: {emulator.cache_page}  rom page: {emulator.rom_page}")
+        print(f"\t{emulator.cycles / max(elapsed, 1e-9) / 1e6:.2f} million cycles per second")
+
+    # profiling report
+    if source_map is not None:
+        report = json.dumps(source_map.profile(emulator.counts), indent=4)
+        if args.profile == "-":
+            print(report)
+        else:
+            with open(args.profile, "w", encoding="utf8") as file:
+                file.write(report)
+
+
+if __name__ == '__main__':
+    main()
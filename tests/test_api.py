@@ -0,0 +1,48 @@
+from pathlib import Path
+import pytest
+import mqa
+
+
+EXAMPLES = Path(__file__).parent.parent / "examples"
+
+ASSIGN_SOURCE = """
+ASSIGN x 5
+LRA x
+UO
+ASSIGN y 7
+LRA y
+ADD x
+UO
+HALT
+"""
+
+
+def test_stream_uses_macro_cache(tmp_path):
+    source = EXAMPLES / "display.mqas"
+    expected = mqa.compile_file(str(source))
+
+    options = mqa.CompileOptions(stream=True, cache_dir=str(tmp_path / "cache"))
+    assert mqa.compile_file(str(source), options=options) == expected
+    assert any((tmp_path / "cache").iterdir())
+
+    # compiled again, with the cached macros
+    assert mqa.compile_file(str(source), options=options) == expected
+
+
+def test_stream_assign_applies_to_later_statements(tmp_path, monkeypatch):
+    source = tmp_path / "assign.mqas"
+    source.write_text(ASSIGN_SOURCE)
+    expected = mqa.compile_file(str(source))
+
+    # every statement is a separate part of the stream
+    monkeypatch.setattr(mqa.Compiler, "STREAM_TOKENS", 1)
+    assert mqa.compile_file(str(source), options=mqa.CompileOptions(stream=True)) == expected
+
+
+def test_name_used_before_assign(tmp_path):
+    source = tmp_path / "assign.mqas"
+    source.write_text("LRA x\nUO\n" + ASSIGN_SOURCE)
+
+    for stream in (False, True):
+        with pytest.raises(ValueError, match="'x' on line 1 .*assigned before"):
+            mqa.compile_file(str(source), options=mqa.CompileOptions(stream=stream))
@@ -0,0 +1,62 @@
+import json
+import mqa
+from mqa._cache import CompileCache
+from mqa._tokenizer import Tokenizer
+
+
+MACRO_SOURCE = """
+macro twice(x) {
+    LRA x
+    ADD x
+}
+
+twice(3)
+HALT
+"""
+
+
+def compile_lines(code: str, macro_cache: dict) -> list[int]:
+    compiler = mqa.Compiler(mqa.CompileOptions(optimize=0), macro_cache=macro_cache)
+    return list(compiler.compile(Tokenizer.build_token_tree(Tokenizer.tokenize(code))).lines)
+
+
+def test_directory_is_scanned_only_past_size_limit(tmp_path, monkeypatch):
+    cache = CompileCache(str(tmp_path), max_size=1000)
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+
+    for idx in range(9):
+        cache.put(cache.make_key(str(idx)), "mqa", bytes(100))
+    cache.put(cache.make_key("0"), "mqa", bytes(100))
+    assert not scans
+
+    cache.put(cache.make_key("9"), "mqa", bytes(200))
+    assert scans
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) <= 1000
+    assert cache._size == sum(path.stat().st_size for path in tmp_path.iterdir())
+
+
+def test_moved_macro_uses_cache_with_its_new_lines():
+    macro_cache = {}
+    compile_lines(MACRO_SOURCE, macro_cache)
+    assert len(macro_cache) == 1
+
+    moved = "\n\n\n" + MACRO_SOURCE
+    assert compile_lines(moved, macro_cache) == compile_lines(moved, None)
+    assert len(macro_cache) == 1
+
+
+def test_entries_are_plain_data(tmp_path):
+    source = MACRO_SOURCE * 2
+    options = mqa.CompileOptions(cache_dir=str(tmp_path))
+    expected = mqa.compile_source(source)
+
+    assert mqa.compile_source(source, options) == expected
+    kinds = {path.suffix for path in tmp_path.iterdir()}
+    assert kinds == {".tree", ".macro"}
+    for path in tmp_path.iterdir():
+        json.loads(path.read_bytes())
+
+    # compiled again, from the cached token tree and macros
+    assert mqa.compile_source(source, options) == expected
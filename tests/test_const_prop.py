@@ -0,0 +1,24 @@
+import mqa
+from mqa.emulator import Emulator
+
+
+def run(code: str, optimize: int) -> Emulator:
+    """
+    Compiles and runs the code
+    :param code: code string
+    :param optimize: optimization level
+    :return: emulator, after the program halted
+    """
+
+    emulator = Emulator.from_bytes(mqa.compile_source(code, mqa.CompileOptions(optimize=optimize)))
+    emulator.run(10000)
+    assert emulator.halted
+    return emulator
+
+
+def test_label_reference_operand_is_unknown():
+    # the value of '$tbl' is not known before the labels are placed, so the second load is not redundant
+    code = "_start:\nLRA 5\nADD $tbl\nLRA 5\nUO\nHALT\ntbl:\nHALT\n"
+    for optimize in (0, 1, 2):
+        assert run(code, optimize).output == run(code, 0).output
+        assert run(code, optimize).acc == 5
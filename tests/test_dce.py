@@ -0,0 +1,42 @@
+import mqa
+from mqa._api import code_compile
+from mqa.emulator import Emulator
+
+
+def run(code: str, passes: list[str]) -> tuple[Emulator, dict[str, int], int]:
+    """
+    Compiles the code with given passes, and runs it
+    :param code: code string
+    :param passes: optimization passes
+    :return: emulator, after the program halted, statistics of the dead code pass, and amount of instructions
+    """
+
+    compiler = code_compile(code, mqa.CompileOptions(optimize=0, passes=passes))
+    emulator = Emulator.from_bytes(mqa.Constructor.generate_bytes(compiler.includes, compiler.main))
+    emulator.run(10000)
+    assert emulator.halted
+    return emulator, compiler.optimization_stats.get("dce", {}), len(compiler.main)
+
+
+def test_unreachable_code_is_removed():
+    code = "_start:\nLRA 1\nUO\nJMP $end\nLRA 2\nUO\nunused:\nLRA 3\nUO\nend:\nHALT\n"
+    emulator, stats, size = run(code, ["dce"])
+    assert stats["unreachable_blocks"] == 1
+    assert stats["dead_labels"] == 1
+    assert emulator.output == run(code, [])[0].output == ["1"]
+    assert size == run(code, [])[2] - 4
+
+
+def test_called_code_is_kept():
+    code = "_start:\nCALL $function\nHALT\nfunction:\nLRA 1\nUO\nRET\n"
+    emulator, stats, size = run(code, ["dce"])
+    assert stats["unreachable_blocks"] == 0
+    assert emulator.output == ["1"]
+
+
+def test_jumps_without_labels_keep_everything():
+    # the jump may go anywhere, so nothing is known to be unreachable
+    code = "_start:\nJMP 4\nLRA 2\nUO\nHALT\nLRA 1\nUO\nHALT\n"
+    emulator, stats, size = run(code, ["dce"])
+    assert size == run(code, [])[2]
+    assert emulator.output == ["1"]
@@ -0,0 +1,9 @@
+import mqa
+from mqa.emulator import Emulator
+
+
+def test_input_is_read_in_order():
+    code = "UI\nUO\nUI\nUO\nUI\nUO\nUI\nUO\nHALT\n"
+    emulator = Emulator.from_bytes(mqa.compile_source(code), input_data=b"\x01\x02\x03")
+    emulator.run(100)
+    assert emulator.output == ["1", "2", "3", "0"]
@@ -0,0 +1,56 @@
+import mqa
+from mqa._api import code_compile
+from mqa.emulator import Emulator
+
+
+def loop_across_pages(setup_length: int) -> str:
+    """
+    :param setup_length: amount of outputs before the loop, which move the loop across the ROM page boundary
+    :return: code of the program with a loop, and with functions that are called once
+    """
+
+    code = ["_start:", "CALL $setup"] + [f"CALL $cold{idx}" for idx in range(6)]
+    code += ["LRA 3", "SRA $0", "CALL $work", "HALT", "setup:"]
+    for idx in range(setup_length):
+        code += [f"LRA {idx % 200}", "UO"]
+    code += ["RET", "work:", "loop:"]
+    for idx in range(8):
+        code += [f"LRA ${idx + 1}", "UO"]
+    code += ["LRA $0", "DEC", "SRA $0", "JMPZ $done", "JMP $loop", "done:", "RET"]
+    for idx in range(6):
+        code += [f"cold{idx}:"] + ["LRA 7", "UO"] * 3 + ["RET"]
+    return "\n".join(code)
+
+
+def run(code: str, passes: list[str]) -> tuple[Emulator, dict[str, int]]:
+    """
+    Compiles the code with given passes, and runs it
+    :param code: code string
+    :param passes: optimization passes
+    :return: emulator, after the program halted, and the statistics of the layout pass
+    """
+
+    compiler = code_compile(code, mqa.CompileOptions(optimize=0, passes=passes))
+    emulator = Emulator.from_bytes(mqa.Constructor.generate_bytes(compiler.includes, compiler.main))
+    emulator.run(100000)
+    assert emulator.halted
+    return emulator, compiler.optimization_stats.get("layout", {})
+
+
+def test_loop_across_pages():
+    # with 120 outputs before it, the loop crosses the end of the first ROM page,
+    # so the jump back to its start needs a CRP, unless the loop is moved to a single page
+    code = loop_across_pages(120)
+    emulator, stats = run(code, ["layout"])
+    reference, _ = run(code, [])
+    assert stats["loop_crp_saved"] >= 1
+    assert emulator.output == reference.output
+    assert emulator.cycles < reference.cycles
+
+
+def test_small_code_is_kept():
+    # code that fits into a single ROM page never needs a CRP
+    code = loop_across_pages(10)
+    emulator, stats = run(code, ["layout"])
+    assert stats["crp_saved"] == 0
+    assert emulator.cycles == run(code, [])[0].cycles
@@ -0,0 +1,22 @@
+import os
+import sys
+import subprocess
+from pathlib import Path
+from mqa._main import parser
+from mqa._passes import PASSES
+
+
+SRC = Path(__file__).parent.parent / "src"
+
+
+def test_registry_names_match_passes():
+    assert all(pass_.name == name for name, pass_ in PASSES.items())
+    assert f"available passes: {', '.join(PASSES)}" in " ".join(parser.format_help().split())
+
+
+def test_cli_does_not_load_compiler():
+    # only the command line module and the pass registry are loaded, until something is compiled
+    code = "import sys, mqa._main; print(sorted(name for name in sys.modules if name.startswith('mqa.')))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=str(SRC)))
+    assert result.stdout.strip() == "['mqa._main', 'mqa._pass_registry']"
@@ -0,0 +1,14 @@
+from mqa._mqis import InstructionSet
+from mqa._mqis_tables import *
+
+
+def test_tables_use_known_instructions():
+    for table in (JUMP_INSTRUCTIONS, CARRY_READING_INSTRUCTIONS, CARRY_WRITING_INSTRUCTIONS,
+                  CARRY_PRESERVING_INSTRUCTIONS):
+        assert table <= InstructionSet.instruction_set.keys()
+
+
+def test_carry_tables_dont_overlap():
+    assert not CARRY_READING_INSTRUCTIONS & CARRY_WRITING_INSTRUCTIONS
+    assert not CARRY_WRITING_INSTRUCTIONS & CARRY_PRESERVING_INSTRUCTIONS
+    assert not CARRY_PRESERVING_INSTRUCTIONS & CARRY_READING_INSTRUCTIONS
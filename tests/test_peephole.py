@@ -0,0 +1,64 @@
+import mqa
+from mqa._api import code_compile
+from mqa.emulator import Emulator
+
+
+def run(code: str, passes: list[str]) -> tuple[Emulator, dict[str, int]]:
+    """
+    Compiles the code with given passes, and runs it
+    :param code: code string
+    :param passes: optimization passes
+    :return: emulator, after the program halted, and the statistics of the peephole pass
+    """
+
+    compiler = code_compile(code, mqa.CompileOptions(optimize=0, passes=passes))
+    emulator = Emulator.from_bytes(mqa.Constructor.generate_bytes(compiler.includes, compiler.main))
+    emulator.run(10000)
+    assert emulator.halted
+    return emulator, compiler.optimization_stats.get("peephole", {})
+
+
+def test_push_pop():
+    code = "LRA 5\nPUSH\nPOP\nUO\nHALT\n"
+    emulator, stats = run(code, ["peephole"])
+    assert stats["push_pop"] == 1
+    assert emulator.output == run(code, [])[0].output == ["5"]
+
+
+def test_store_after_load():
+    # the loaded cell already holds the value
+    code = "LRA 7\nSRA 3\nLRA $3\nSRA 3\nUO\nHALT\n"
+    emulator, stats = run(code, ["peephole"])
+    assert stats["store_after_load"] == 1
+    assert emulator.output == ["7"]
+
+
+def test_inc_dec_with_dead_carry():
+    code = "LRA 200\nADD 100\nINC\nDEC\nADD 1\nUO\nHALT\n"
+    emulator, stats = run(code, ["peephole"])
+    assert stats["inc_dec"] == 1
+    assert emulator.output == run(code, [])[0].output == ["45"]
+
+
+def test_inc_dec_with_live_carry():
+    # 'INC' and 'DEC' clear the carry flag, which was set by 'ADD', and 'ADC' uses it
+    code = "LRA 200\nADD 100\nINC\nDEC\nADC 0\nUO\nHALT\n"
+    emulator, stats = run(code, ["peephole"])
+    assert stats["inc_dec"] == 0
+    assert emulator.output == ["44"]
+
+
+def test_window_does_not_cross_label():
+    # 'POP' is also jumped to, when the accumulator holds a different value
+    code = "_start:\nLRA 1\nPUSH\nLRA 9\nJMP $pop\nLRA 2\nPUSH\npop:\nPOP\nUO\nHALT\n"
+    emulator, stats = run(code, ["peephole"])
+    assert stats["push_pop"] == 0
+    assert emulator.output == ["1"]
+
+
+def test_jump_threading():
+    code = "_start:\nJMP $first\nLRA 1\nUO\nfirst:\nJMP $second\nLRA 2\nUO\nsecond:\nLRA 3\nUO\nHALT\n"
+    emulator, stats = run(code, ["peephole"])
+    assert stats["jump_threading"] == 1
+    assert emulator.output == ["3"]
+    assert emulator.cycles < run(code, [])[0].cycles
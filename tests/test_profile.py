@@ -0,0 +1,41 @@
+import json
+import tracemalloc
+from mqa._profile import Profiler
+
+
+def test_tracing_stops_after_phase():
+    profiler = Profiler()
+    with profiler.phase("outer"):
+        with profiler.phase("inner"):
+            data = [0] * 10000
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+    assert profiler.phases["outer"]["peak_memory"] >= len(data) * 8
+    assert "inner" not in profiler.phases
+
+
+def test_tracing_started_elsewhere_is_kept():
+    tracemalloc.start()
+    try:
+        with Profiler().phase("phase"):
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_cached_run_is_profiled(tmp_path):
+    from mqa._main import parser, compile_code
+
+    output = str(tmp_path / "program.mqa")
+    report = tmp_path / "profile.json"
+    args = parser.parse_args(["program.mqas", "--cache-dir", str(tmp_path / "cache"), "--profile", str(report)])
+
+    compile_code("LRA 1\nHALT", output, args)
+    assert json.loads(report.read_text())["cache_hit"] is False
+
+    report.unlink()
+    compile_code("LRA 1\nHALT", output, args)
+    cached = json.loads(report.read_text())
+    assert cached["cache_hit"] is True
+    assert "cache_read" in cached["phases"]